@@ -0,0 +1,160 @@
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+LOCK_KEY_PREFIX = "lock"
+SKIPPED_KEY = f"{LOCK_KEY_PREFIX}:skipped"
+
+# Deletes or extends the lease only while it is still held by the token, so a
+# worker whose lease expired never touches the lease of the next holder.
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+EXTEND_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class LeaseLock:
+    """Lock held by one worker at a time as an expiring Redis lease.
+
+    The holder extends the lease with heartbeats while it works; the lease of
+    a crashed worker expires after ``ttl`` seconds. Redis errors are treated
+    as an acquired lock, so work goes on when Redis is unavailable.
+    """
+
+    def __init__(self, name, token=None, ttl=None):
+        self.name = name
+        self.key = f"{LOCK_KEY_PREFIX}:{name}"
+        self.ttl = ttl or settings.TASK_LOCK_TTL_SECONDS
+        self.token = token or uuid.uuid4().hex
+
+    @property
+    def lease(self) -> list:
+        """Name and token of the lease, to hand it over to other tasks."""
+        return [self.name, self.token]
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    def acquire(self) -> bool:
+        try:
+            return bool(
+                self.redis.set(self.key, self.token, nx=True, px=int(self.ttl * 1000))
+            )
+        except RedisError:
+            return True
+
+    def extend(self) -> bool:
+        try:
+            return bool(
+                self.redis.eval(
+                    EXTEND_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000)
+                )
+            )
+        except RedisError:
+            return True
+
+    def release(self) -> bool:
+        try:
+            return bool(self.redis.eval(RELEASE_SCRIPT, 1, self.key, self.token))
+        except RedisError:
+            return False
+
+    @contextmanager
+    def heartbeat(self):
+        """Extends the lease every third of its ttl until the block exits."""
+        stopped = threading.Event()
+
+        def beat():
+            while not stopped.wait(self.ttl / 3):
+                if not self.extend():
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stopped.set()
+            thread.join()
+
+
+def record_skipped(name):
+    try:
+        get_redis_connection("default").hincrby(SKIPPED_KEY, name, 1)
+    except RedisError:
+        pass
+
+
+def get_skipped_counts() -> dict:
+    """Returns how many runs of every lock name were skipped as already running."""
+    try:
+        counts = get_redis_connection("default").hgetall(SKIPPED_KEY)
+    except RedisError:
+        return {}
+    return {name.decode(): int(count) for name, count in counts.items()}
+
+
+def acquire_singleton(name) -> LeaseLock | None:
+    """Returns the acquired lock of ``name``, or records a skipped run."""
+    lock = LeaseLock(name)
+    if lock.acquire():
+        return lock
+    record_skipped(name)
+    return None
+
+
+def get_chord_key(name) -> str:
+    return f"{LOCK_KEY_PREFIX}:{name}:chord"
+
+
+def set_running_chord(name, task_id):
+    """Remembers the chord dispatched by the current run of ``name``."""
+    try:
+        get_redis_connection("default").set(
+            get_chord_key(name), task_id, ex=int(settings.TASK_CHORD_TTL_SECONDS)
+        )
+    except RedisError:
+        pass
+
+
+def get_running_chord(name) -> str | None:
+    try:
+        task_id = get_redis_connection("default").get(get_chord_key(name))
+    except RedisError:
+        return None
+    return task_id.decode() if task_id else None
+
+
+def clear_running_chord(name, task_id):
+    """Forgets the chord of ``name`` unless a newer one was dispatched since."""
+    try:
+        get_redis_connection("default").eval(
+            RELEASE_SCRIPT, 1, get_chord_key(name), task_id
+        )
+    except RedisError:
+        pass
+
+
+@contextmanager
+def keep_lease(lease):
+    """Keeps a lease handed over by another task alive while the block runs."""
+    if not lease:
+        yield None
+        return
+    lock = LeaseLock(*lease)
+    lock.extend()
+    with lock.heartbeat():
+        yield lock
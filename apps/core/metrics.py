@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+METRICS_KEY_PREFIX = "metrics"
+COUNTERS_KEY = f"{METRICS_KEY_PREFIX}:counters"
+GAUGES_KEY = f"{METRICS_KEY_PREFIX}:gauges"
+
+
+class MetricsRegistry:
+    """Collects counters, timings and gauges in process.
+
+    Every process keeps its own registry and periodically adds it to the
+    shared totals in Redis with ``flush``, so metrics of all web and worker
+    processes are exported together by ``render``. Timings are kept as
+    Prometheus summaries, a ``_sum`` and a ``_count`` counter.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(name, labels) -> str:
+        return json.dumps([name, sorted(labels.items())])
+
+    def inc(self, name, value=1, **labels):
+        key = self.get_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        self.inc(f"{name}_sum", value, **labels)
+        self.inc(f"{name}_count", 1, **labels)
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self.get_key(name, labels)] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the duration of the block and counts its errors by class."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception as exc:
+            self.inc(f"{name}_errors_total", error=type(exc).__name__, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def timed(self, name, **labels):
+        """Decorates a function with ``timer``."""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self) -> dict:
+        """Returns the metrics collected since the last flush, keyed readably."""
+        with self._lock:
+            items = [*self.counters.items(), *self.gauges.items()]
+        snapshot = {}
+        for key, value in items:
+            name, labels = json.loads(key)
+            label_text = ",".join(f"{label}={text}" for label, text in labels)
+            snapshot[f"{name}{{{label_text}}}" if labels else name] = value
+        return snapshot
+
+    def flush(self):
+        """Adds the collected metrics to the shared totals and resets them."""
+        with self._lock:
+            counters, self.counters = self.counters, {}
+            gauges, self.gauges = self.gauges, {}
+        if not counters and not gauges:
+            return
+        try:
+            pipeline = get_redis_connection("default").pipeline()
+            for key, value in counters.items():
+                pipeline.hincrbyfloat(COUNTERS_KEY, key, value)
+            if gauges:
+                pipeline.hset(GAUGES_KEY, mapping=gauges)
+            pipeline.execute()
+        except RedisError:
+            # Keep the counts for the next flush
+            with self._lock:
+                for key, value in counters.items():
+                    self.counters[key] = self.counters.get(key, 0) + value
+                self.gauges = {**gauges, **self.gauges}
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for label, value in labels
+    )
+
+
+def render(extra_gauges=None) -> str:
+    """Renders the shared metrics totals in the Prometheus text format."""
+    try:
+        redis = get_redis_connection("default")
+        counters = redis.hgetall(COUNTERS_KEY)
+        gauges = redis.hgetall(GAUGES_KEY)
+    except RedisError:
+        counters, gauges = {}, {}
+
+    families = {}
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for key, value in values.items():
+            name, labels = json.loads(key)
+            family, family_kind = name, kind
+            if kind == "counter" and name.endswith(("_sum", "_count")):
+                family, family_kind = name.rsplit("_", 1)[0], "summary"
+            families.setdefault(family, (family_kind, []))[1].append(
+                (name, labels, float(value))
+            )
+    for (name, labels), value in (extra_gauges or {}).items():
+        families.setdefault(name, ("gauge", []))[1].append((name, labels, value))
+
+    lines = []
+    for family, (kind, samples) in sorted(families.items()):
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in sorted(samples, key=lambda sample: sample[:2]):
+            lines.append(f"{name}{format_labels(labels)} {value!r}")
+    return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
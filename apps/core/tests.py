@@ -1 +1,112 @@
-# Create your tests here.
+import time
+import uuid
+
+from core.locks import (
+    SKIPPED_KEY,
+    LeaseLock,
+    acquire_singleton,
+    clear_running_chord,
+    get_chord_key,
+    get_running_chord,
+    get_skipped_counts,
+    set_running_chord,
+)
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django_redis import get_redis_connection
+
+from config.celery import acquire_pass
+
+
+@override_settings(
+    METRICS_ALLOWED_IPS=["10.0.0.5"],
+    METRICS_TRUSTED_PROXIES=["10.0.0.2"],
+    METRICS_TOKEN="secret",
+)
+class MetricsViewTestCase(TestCase):
+    def get(self, remote_addr="10.0.0.9", **headers):
+        return self.client.get(reverse("metrics"), REMOTE_ADDR=remote_addr, **headers)
+
+    def test_allowed_address(self):
+        response = self.get("10.0.0.5")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+    def test_other_address_is_forbidden(self):
+        self.assertEqual(self.get().status_code, 403)
+
+    def test_forged_client_address_is_ignored(self):
+        response = self.get(HTTP_X_REAL_IP="10.0.0.5")
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_client_address_from_the_proxy(self):
+        response = self.get("10.0.0.2", HTTP_X_REAL_IP="10.0.0.5")
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_token(self):
+        self.assertEqual(self.get(HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+
+
+class LeaseLockTestCase(SimpleTestCase):
+    def setUp(self):
+        self.name = f"test:{uuid.uuid4().hex}"
+        self.addCleanup(self.delete_keys)
+
+    def delete_keys(self):
+        redis = get_redis_connection("default")
+        redis.delete(LeaseLock(self.name).key, get_chord_key(self.name))
+        redis.hdel(SKIPPED_KEY, self.name)
+
+    def test_one_holder_at_a_time(self):
+        lock = acquire_singleton(self.name)
+
+        self.assertIsNotNone(lock)
+        self.assertIsNone(acquire_singleton(self.name))
+        self.assertEqual(get_skipped_counts()[self.name], 1)
+        # Only the holder can release the lease
+        self.assertFalse(LeaseLock(self.name).release())
+        self.assertTrue(lock.release())
+        self.assertIsNotNone(acquire_singleton(self.name))
+
+    def test_expired_lease_is_not_released_by_its_old_holder(self):
+        lock = LeaseLock(self.name, ttl=0.05)
+        lock.acquire()
+        time.sleep(0.1)
+        successor = acquire_singleton(self.name)
+
+        self.assertIsNotNone(successor)
+        self.assertFalse(lock.release())
+        self.assertFalse(lock.extend())
+        self.assertIsNone(acquire_singleton(self.name))
+
+    def test_heartbeat_keeps_the_lease(self):
+        lock = LeaseLock(self.name, ttl=0.15)
+        lock.acquire()
+
+        with lock.heartbeat():
+            time.sleep(0.4)
+            self.assertFalse(LeaseLock(self.name).acquire())
+
+    def test_pass_is_skipped_while_its_chord_runs(self):
+        task_id = uuid.uuid4().hex
+        set_running_chord(self.name, task_id)
+
+        self.assertIsNone(acquire_pass(self.name))
+        # The lease taken while checking the chord was given back
+        self.assertTrue(LeaseLock(self.name).acquire())
+        self.assertEqual(get_skipped_counts()[self.name], 1)
+
+    def test_finished_chord_is_forgotten(self):
+        set_running_chord(self.name, "old")
+        set_running_chord(self.name, "new")
+
+        clear_running_chord(self.name, "old")
+        self.assertEqual(get_running_chord(self.name), "new")
+
+        clear_running_chord(self.name, "new")
+        self.assertIsNone(get_running_chord(self.name))
+        self.assertIsNotNone(acquire_pass(self.name))
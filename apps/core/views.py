@@ -1,6 +1,14 @@
+from hmac import compare_digest
+
+from core.locks import get_skipped_counts
+from core.metrics import render
 from core.pagination import CustomPageNumberPagination
+from django.conf import settings
+from django.db.models import Max
+from django.http import HttpResponse, HttpResponseForbidden
 from rest_framework import generics
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from scraper.models import ScrapeRun, ScrapeRunStatuses
 
 
 class BaseListCreateAPIView(generics.ListCreateAPIView):
@@ -25,3 +33,47 @@ class BaseListAPIView(generics.ListAPIView):
         context = super().get_serializer_context()
         context["request"] = self.request
         return context
+
+
+def get_client_ip(request) -> str:
+    remote_addr = request.META.get("REMOTE_ADDR", "")
+    # nginx passes the address of the client in X-Real-IP; anyone reaching
+    # the app directly could forge the header
+    if remote_addr in settings.METRICS_TRUSTED_PROXIES:
+        return request.META.get("HTTP_X_REAL_IP") or remote_addr
+    return remote_addr
+
+
+def has_metrics_token(request) -> bool:
+    return bool(settings.METRICS_TOKEN) and compare_digest(
+        request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {settings.METRICS_TOKEN}"
+    )
+
+
+def metrics_view(request):
+    """Exports the scraper and Celery metrics in the Prometheus text format.
+
+    Readable with the ``METRICS_TOKEN`` bearer token or from the addresses of
+    ``METRICS_ALLOWED_IPS``.
+    """
+    if (
+        not has_metrics_token(request)
+        and get_client_ip(request) not in settings.METRICS_ALLOWED_IPS
+    ):
+        return HttpResponseForbidden()
+
+    extra_gauges = {
+        ("task_lock_skipped_runs", (("task", name),)): count
+        for name, count in get_skipped_counts().items()
+    }
+    for run in (
+        ScrapeRun.objects.filter(status=ScrapeRunStatuses.SUCCESS)
+        .values("task")
+        .annotate(last_success=Max("started_at"))
+    ):
+        extra_gauges[
+            ("scrape_run_last_success_timestamp_seconds", (("task", run["task"]),))
+        ] = run["last_success"].timestamp()
+    return HttpResponse(
+        render(extra_gauges), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
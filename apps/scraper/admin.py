@@ -12,6 +12,7 @@ from scraper.models import (
     Product,
     RequestedComment,
     RequestedCommentFile,
+    ScrapeRun,
 )
 from scraper.utils.queryset import get_comments, get_products
 from unfold.admin import ModelAdmin, StackedInline
@@ -25,6 +26,7 @@ class CategoryAdmin(ModelAdmin):
         "parent",
         "source_id",
         "shard",
+        "product_count",
     )
     search_fields = (
         "title",
@@ -288,3 +290,41 @@ class RequestedCommentAdmin(BaseCommentAdmin):
 
     def has_view_permission(self, request, obj=None):
         return True
+
+
+@admin.register(ScrapeRun)
+class ScrapeRunAdmin(ModelAdmin):
+    list_display = (
+        "task",
+        "status",
+        "started_at",
+        "duration",
+    )
+    list_filter = ("task", "status")
+    search_fields = ("task", "task_id")
+    fields = (
+        "task",
+        "task_id",
+        "status",
+        "started_at",
+        "duration",
+        "error",
+        "report",
+        "metrics",
+    )
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_module_permission(self, request):
+        return request.user.is_superuser
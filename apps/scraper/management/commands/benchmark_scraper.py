@@ -0,0 +1,297 @@
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from scraper.models import Category, Comment, CommentFiles, FeedbackCursor, Product
+from scraper.utils.categories import load_fixture_categories
+from scraper.utils.fake_wildberries import FakeWildberries, FakeWildberriesServer
+from scraper.utils.wildberries_client import WildberriesClient
+
+WRITTEN_MODELS = (Category, Product, Comment, CommentFiles, FeedbackCursor)
+UPDATED_REPORT_KEYS = ("updated", "renamed", "reparented", "matched")
+
+
+def get_row_counts() -> dict:
+    return {model.__name__: model.objects.count() for model in WRITTEN_MODELS}
+
+
+def get_rss() -> int:
+    """Returns the current resident set size of the process in kilobytes.
+
+    Falls back to the peak of the whole process where ``/proc`` is missing.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+class RssSampler:
+    """Samples the resident set size while a stage runs to find its own peak."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_kb = self.peak_kb = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        self.peak_kb = max(self.peak_kb, get_rss())
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.start_kb = self.peak_kb = get_rss()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self.sample()
+
+
+def get_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the scraper stages against a seeded test database and a "
+        "local Wildberries stand-in, appending one JSON line per stage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="benchmark_results.jsonl")
+        parser.add_argument(
+            "--categories", type=int, default=10, help="Subcategories to scrape"
+        )
+        parser.add_argument("--pending-products", type=int, default=20)
+        parser.add_argument("--catalog-pages", type=int, default=2)
+        parser.add_argument("--products-per-page", type=int, default=100)
+        parser.add_argument("--feedbacks-per-root", type=int, default=10)
+        parser.add_argument("--latency", type=float, default=0.0)
+        parser.add_argument("--error-rate", type=float, default=0.0)
+        parser.add_argument("--throttle-rate", type=float, default=0.0)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=1000.0,
+            help="Requests per second allowed per host during the run",
+        )
+        parser.add_argument(
+            "--upstream",
+            help="URL of an already running stand-in to use instead of starting one",
+        )
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        run = {
+            "run_id": uuid.uuid4().hex,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "revision": get_revision(),
+            "database": connection.vendor,
+            "options": {
+                key: options[key]
+                for key in (
+                    "categories",
+                    "pending_products",
+                    "catalog_pages",
+                    "products_per_page",
+                    "feedbacks_per_root",
+                    "latency",
+                    "error_rate",
+                    "throttle_rate",
+                    "seed",
+                    "rate",
+                )
+            },
+        }
+        server = None
+        if not options["upstream"]:
+            server = FakeWildberriesServer(
+                FakeWildberries(
+                    catalog_pages=options["catalog_pages"],
+                    products_per_page=options["products_per_page"],
+                    feedbacks_per_root=options["feedbacks_per_root"],
+                    latency=options["latency"],
+                    error_rate=options["error_rate"],
+                    throttle_rate=options["throttle_rate"],
+                    seed=options["seed"],
+                )
+            ).start()
+
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options["keepdb"]
+        )
+        # Every Redis key of the run, raw or cached, lives under its own prefix,
+        # so throttling of the stand-in never reaches the live rate limits
+        key_prefix = f"benchmark:{run['run_id']}"
+        try:
+            with override_settings(
+                WB_UPSTREAM_URL=options["upstream"] or server.url,
+                WB_RATE_LIMITS={},
+                WB_RATE_LIMIT_DEFAULT=options["rate"],
+                WB_REDIS_KEY_PREFIX=f"{key_prefix}:wb",
+                CACHES={
+                    "default": {
+                        **settings.CACHES["default"],
+                        "KEY_PREFIX": key_prefix,
+                    }
+                },
+            ):
+                try:
+                    results = self.run_stages(options)
+                finally:
+                    self.delete_keys(key_prefix)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"]
+            )
+            if server:
+                server.stop()
+
+        with open(options["output"], "a", encoding="utf-8") as file:
+            for result in results:
+                file.write(json.dumps({**run, **result}, default=str) + "\n")
+        for result in results:
+            self.stdout.write(
+                "{stage}: {wall_seconds:.2f}s, {requests_per_second:.1f} req/s, "
+                "{queries_per_item:.2f} queries/item, {rows_per_second:.1f} rows/s, "
+                "peak RSS {peak_rss_kb} KB (+{rss_growth_kb} KB)".format(**result)
+            )
+
+    @staticmethod
+    def delete_keys(key_prefix):
+        try:
+            redis = get_redis_connection("default")
+            keys = list(redis.scan_iter(f"{key_prefix}:*"))
+            if keys:
+                redis.delete(*keys)
+        except (NotImplementedError, RedisError):
+            pass
+
+    def seed(self):
+        """Creates the top-level categories the category sync starts from."""
+        Category.objects.bulk_create(
+            Category(
+                source_id=category["id"],
+                title=category["name"],
+                slug_name=category.get("url"),
+                shard=category.get("shard"),
+            )
+            for category in load_fixture_categories()
+        )
+
+    def run_stages(self, options) -> list[dict]:
+        client = WildberriesClient()
+        self.seed()
+        stages = [
+            ("get_categories", client.get_categories, None),
+            (
+                "get_products",
+                lambda: client.get_products(
+                    list(
+                        Category.objects.filter(parent__isnull=False).order_by("id")[
+                            : options["categories"]
+                        ]
+                    )
+                ),
+                None,
+            ),
+            ("get_product_comments", client.get_product_comments, None),
+            (
+                "update_products",
+                client.update_products,
+                lambda: self.forget_source_ids(options["pending_products"]),
+            ),
+            (
+                "update_product_image_links",
+                client.update_product_image_links,
+                lambda: Product.objects.update(image_link=None),
+            ),
+        ]
+        return [
+            self.run_stage(client, name, function, setup)
+            for name, function, setup in stages
+        ]
+
+    def forget_source_ids(self, count):
+        """Clears the source_id of the first products of every category."""
+        pks = []
+        for category_id in Product.objects.values_list(
+            "category_id", flat=True
+        ).distinct():
+            pks.extend(
+                Product.objects.filter(category_id=category_id)
+                .order_by("id")
+                .values_list("pk", flat=True)[:count]
+            )
+        Product.objects.filter(pk__in=pks).update(source_id=None)
+
+    def run_stage(self, client, name, function, setup) -> dict:
+        if setup:
+            setup()
+        requests_before = sum(
+            host["requests"] for host in client.sessions.stats().values()
+        )
+        rows_before = get_row_counts()
+
+        with CaptureQueriesContext(connection) as queries, RssSampler() as rss:
+            started_at = time.perf_counter()
+            report = function()
+            wall_seconds = time.perf_counter() - started_at
+
+        requests = (
+            sum(host["requests"] for host in client.sessions.stats().values())
+            - requests_before
+        )
+        rows_after = get_row_counts()
+        inserted = {
+            model: rows_after[model] - rows_before[model] for model in rows_after
+        }
+        if isinstance(report, dict):
+            updated = sum(report.get(key, 0) for key in UPDATED_REPORT_KEYS)
+        else:
+            updated = report or 0
+        rows_written = sum(count for count in inserted.values() if count > 0) + updated
+        return {
+            "stage": name,
+            "wall_seconds": wall_seconds,
+            "requests": requests,
+            "requests_per_second": requests / wall_seconds if wall_seconds else 0,
+            "queries": len(queries),
+            "queries_per_item": len(queries) / max(rows_written, 1),
+            "rows_written": rows_written,
+            "rows_inserted": inserted,
+            "rows_per_second": rows_written / wall_seconds if wall_seconds else 0,
+            "peak_rss_kb": rss.peak_kb,
+            "rss_growth_kb": rss.peak_kb - rss.start_kb,
+            "report": report,
+        }
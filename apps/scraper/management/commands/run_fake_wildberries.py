@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from scraper.utils.fake_wildberries import FakeWildberries, FakeWildberriesServer
+
+
+class Command(BaseCommand):
+    help = "Runs a local stand-in for the Wildberries endpoints used by the scraper."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--fixtures", help="Directory of recorded responses to replay"
+        )
+        parser.add_argument("--catalog-pages", type=int, default=3)
+        parser.add_argument("--products-per-page", type=int, default=100)
+        parser.add_argument("--feedbacks-per-root", type=int, default=10)
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds added to responses"
+        )
+        parser.add_argument(
+            "--error-rate", type=float, default=0.0, help="Share of 503 responses"
+        )
+        parser.add_argument(
+            "--throttle-rate", type=float, default=0.0, help="Share of 429 responses"
+        )
+        parser.add_argument("--retry-after", type=int, default=1)
+        parser.add_argument("--seed", type=int)
+
+    def handle(self, *args, **options):
+        fake = FakeWildberries(
+            fixtures_dir=options["fixtures"],
+            catalog_pages=options["catalog_pages"],
+            products_per_page=options["products_per_page"],
+            feedbacks_per_root=options["feedbacks_per_root"],
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            throttle_rate=options["throttle_rate"],
+            retry_after=options["retry_after"],
+            seed=options["seed"],
+        )
+        server = FakeWildberriesServer(fake, options["host"], options["port"])
+        self.stdout.write(f"Serving fake Wildberries, set WB_UPSTREAM_URL={server.url}")
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server.server_close()
+            self.stdout.write(str(fake.stats()))
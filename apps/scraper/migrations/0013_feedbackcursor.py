@@ -0,0 +1,62 @@
+# Generated by Django 5.0.8 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraper", "0012_requestedcomment_comment_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FeedbackCursor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                ("updated_at", models.DateTimeField(auto_now=True, db_index=True)),
+                (
+                    "deleted_at",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+                ("root", models.IntegerField(unique=True, verbose_name="Root")),
+                (
+                    "last_feedback_date",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Last feedback date"
+                    ),
+                ),
+                (
+                    "last_feedback_id",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="Last feedback ID"
+                    ),
+                ),
+                (
+                    "checked_at",
+                    models.DateTimeField(
+                        blank=True, db_index=True, null=True, verbose_name="Checked at"
+                    ),
+                ),
+                (
+                    "changed_at",
+                    models.DateTimeField(
+                        blank=True, db_index=True, null=True, verbose_name="Changed at"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Feedback cursor",
+                "verbose_name_plural": "Feedback cursors",
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.8 on 2026-10-16 23:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_product_counts(apps, schema_editor):
+    Category = apps.get_model("scraper", "Category")
+    Product = apps.get_model("scraper", "Product")
+
+    counts = (
+        Product.objects.filter(category=OuterRef("pk"))
+        .order_by()
+        .values("category")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    Category.objects.update(product_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraper", "0013_feedbackcursor"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="product_count",
+            field=models.PositiveIntegerField(
+                db_index=True, default=0, verbose_name="Product count"
+            ),
+        ),
+        migrations.RunPython(set_product_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.8 on 2026-10-17 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraper", "0014_category_product_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="change_rate",
+            field=models.FloatField(default=0, verbose_name="Change rate"),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="scraped_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, null=True, verbose_name="Scraped at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="feedbackcursor",
+            name="change_rate",
+            field=models.FloatField(default=0, verbose_name="Change rate"),
+        ),
+    ]
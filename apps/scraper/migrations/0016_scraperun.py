@@ -0,0 +1,76 @@
+# Generated by Django 5.0.8 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraper", "0015_category_scraped_at_change_rate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScrapeRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                ("updated_at", models.DateTimeField(auto_now=True, db_index=True)),
+                (
+                    "deleted_at",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+                (
+                    "task",
+                    models.CharField(
+                        db_index=True, max_length=255, verbose_name="Task"
+                    ),
+                ),
+                (
+                    "task_id",
+                    models.CharField(
+                        blank=True, max_length=255, null=True, verbose_name="Task ID"
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("success", "Success"),
+                            ("failure", "Failure"),
+                            ("skipped", "Skipped"),
+                        ],
+                        db_index=True,
+                        max_length=20,
+                        verbose_name="Status",
+                    ),
+                ),
+                ("started_at", models.DateTimeField(verbose_name="Started at")),
+                ("duration", models.FloatField(verbose_name="Duration")),
+                (
+                    "error",
+                    models.TextField(blank=True, null=True, verbose_name="Error"),
+                ),
+                (
+                    "report",
+                    models.JSONField(blank=True, null=True, verbose_name="Report"),
+                ),
+                (
+                    "metrics",
+                    models.JSONField(blank=True, default=dict, verbose_name="Metrics"),
+                ),
+            ],
+            options={
+                "verbose_name": "Scrape run",
+                "verbose_name_plural": "Scrape runs",
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.8 on 2026-10-17 00:13
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def set_content_hashes(apps, schema_editor):
+    Comment = apps.get_model("scraper", "Comment")
+
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "UPDATE {} SET content_hash = encode(sha256(convert_to(content, 'UTF8')), "
+            "'hex') WHERE content IS NOT NULL".format(
+                schema_editor.quote_name(Comment._meta.db_table)
+            )
+        )
+        return
+
+    comments = []
+    for comment in (
+        Comment.objects.filter(content__isnull=False)
+        .only("content")
+        .iterator(chunk_size=BATCH_SIZE)
+    ):
+        comment.content_hash = hashlib.sha256(comment.content.encode()).hexdigest()
+        comments.append(comment)
+        if len(comments) >= BATCH_SIZE:
+            Comment.objects.bulk_update(comments, ["content_hash"])
+            comments = []
+    Comment.objects.bulk_update(comments, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraper", "0016_scraperun"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+        migrations.RunPython(set_content_hashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["product", "content_hash"], name="product_content_hash_idx"
+            ),
+        ),
+    ]
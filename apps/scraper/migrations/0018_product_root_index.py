@@ -0,0 +1,20 @@
+# Generated by Django 5.0.8 on 2026-10-17 00:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraper", "0017_comment_content_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="product",
+            name="root",
+            field=models.IntegerField(
+                blank=True, db_index=True, null=True, verbose_name="Root"
+            ),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import hashlib
+
 from core.models import BaseModel
 from django.db import models
 from django.db.models import Q, UniqueConstraint
@@ -25,6 +27,13 @@ class Category(BaseModel):
     )
     shard: str = models.TextField(null=True, blank=True, verbose_name=_("Shard"))
     position: int = models.IntegerField(default=0)
+    product_count: int = models.PositiveIntegerField(
+        default=0, db_index=True, verbose_name=_("Product count")
+    )
+    scraped_at = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name=_("Scraped at")
+    )
+    change_rate: float = models.FloatField(default=0, verbose_name=_("Change rate"))
 
     def __str__(self) -> str:
         return self.title
@@ -59,7 +68,9 @@ class Product(BaseModel):
         verbose_name=_("Category"),
         db_index=True,
     )
-    root: int = models.IntegerField(null=True, blank=True, verbose_name=_("Root"))
+    root: int = models.IntegerField(
+        null=True, blank=True, db_index=True, verbose_name=_("Root")
+    )
     source_id: int = models.PositiveBigIntegerField(
         unique=True, null=True, blank=True, verbose_name=_("Source ID")
     )
@@ -85,6 +96,61 @@ class Product(BaseModel):
         ]
 
 
+class FeedbackCursor(BaseModel):
+    root: int = models.IntegerField(unique=True, verbose_name=_("Root"))
+    last_feedback_date = models.DateTimeField(
+        null=True, blank=True, verbose_name=_("Last feedback date")
+    )
+    last_feedback_id: str = models.TextField(
+        null=True, blank=True, verbose_name=_("Last feedback ID")
+    )
+    checked_at = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name=_("Checked at")
+    )
+    changed_at = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name=_("Changed at")
+    )
+    change_rate: float = models.FloatField(default=0, verbose_name=_("Change rate"))
+
+    def __str__(self) -> str:
+        return str(self.root)
+
+    class Meta:
+        verbose_name = _("Feedback cursor")
+        verbose_name_plural = _("Feedback cursors")
+
+
+class ScrapeRunStatuses(models.TextChoices):
+    SUCCESS: tuple[str] = "success", _("Success")
+    FAILURE: tuple[str] = "failure", _("Failure")
+    SKIPPED: tuple[str] = "skipped", _("Skipped")
+
+
+class ScrapeRun(BaseModel):
+    task: str = models.CharField(max_length=255, db_index=True, verbose_name=_("Task"))
+    task_id: str = models.CharField(
+        max_length=255, null=True, blank=True, verbose_name=_("Task ID")
+    )
+    status: str = models.CharField(
+        max_length=20,
+        choices=ScrapeRunStatuses.choices,
+        db_index=True,
+        verbose_name=_("Status"),
+    )
+    started_at = models.DateTimeField(verbose_name=_("Started at"))
+    duration: float = models.FloatField(verbose_name=_("Duration"))
+    error: str = models.TextField(null=True, blank=True, verbose_name=_("Error"))
+    report = models.JSONField(null=True, blank=True, verbose_name=_("Report"))
+    metrics = models.JSONField(default=dict, blank=True, verbose_name=_("Metrics"))
+
+    def __str__(self) -> str:
+        return f"{self.task} {self.started_at}"
+
+    class Meta:
+        verbose_name = _("Scrape run")
+        verbose_name_plural = _("Scrape runs")
+
+
 class FileTypeChoices(models.TextChoices):
     IMAGE: tuple[str] = "image", _("Image")
     VIDEO: tuple[str] = "video", _("Video")
@@ -110,6 +176,9 @@ class Comment(BaseModel):
     )
     product_source_id: int = models.PositiveBigIntegerField(null=True, blank=True)
     content: str = models.TextField(null=True, blank=True, verbose_name=_("Content"))
+    content_hash: str = models.CharField(
+        max_length=64, null=True, blank=True, editable=False
+    )
     rating: int = models.IntegerField(verbose_name=_("Rating"))
     status: str = models.CharField(
         max_length=50,
@@ -149,6 +218,20 @@ class Comment(BaseModel):
     def __str__(self) -> str:
         return str(self.pk)
 
+    @staticmethod
+    def get_content_hash(content) -> str | None:
+        """Returns the SHA-256 hex digest comments are deduplicated by."""
+        if content is None:
+            return None
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.get_content_hash(self.content)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "content" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "content_hash"}
+        super().save(*args, **kwargs)
+
     class Meta:
         constraints = [
             UniqueConstraint(
@@ -170,6 +253,9 @@ class Comment(BaseModel):
             # Composite indexes
             models.Index(fields=["status", "content"], name="status_content_idx"),
             models.Index(fields=["product", "source_id"], name="product_source_id_idx"),
+            models.Index(
+                fields=["product", "content_hash"], name="product_content_hash_idx"
+            ),
         ]
 
 
@@ -1,8 +1,11 @@
+from functools import partial
+
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from scraper.models import Comment, CommentStatuses
-from scraper.utils import wildberries
-from scraper.utils.notify import send_comment_notification, send_no_product_message
+from scraper.utils.notify import send_comment_notification
+from scraper.utils.resolution import enqueue_product_resolution
 
 
 @receiver(post_save, sender=Comment)
@@ -13,10 +16,7 @@ def send_email_to_user(sender, instance, **kwargs):
         and not instance.product
         and instance.status == CommentStatuses.ACCEPTED
     ):
-        product = wildberries.get_product_by_source_id(instance.product_source_id)
-        if product:
-            instance.product = product
-            instance.save(update_fields=["product"])
-        else:
-            send_no_product_message(instance, instance.product_source_id)
-            instance.delete()
+        # The product is looked up by a worker once the comment is committed
+        transaction.on_commit(
+            partial(enqueue_product_resolution, instance.product_source_id)
+        )
@@ -1 +1,917 @@
-# Create your tests here.
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+from scraper.models import (
+    Category,
+    Comment,
+    CommentFiles,
+    CommentStatuses,
+    FeedbackCursor,
+    FileTypeChoices,
+    Product,
+)
+from scraper.utils.categories import (
+    CategoryMenu,
+    CategorySource,
+    find_breadcrumb_slug,
+    sync_categories,
+)
+from scraper.utils.fake_wildberries import FakeWildberries, FakeWildberriesServer
+from scraper.utils.fetcher import AsyncFetcher
+from scraper.utils.ingest import (
+    advance_feedback_cursors,
+    backfill_product_image_links,
+    get_feedback_cursors,
+    get_feedback_source_id,
+    get_published_date,
+    ingest_feedbacks,
+    select_new_feedbacks,
+    upsert_products,
+)
+from scraper.utils.matching import TitleMatcher
+from scraper.utils.resilience import CircuitBreaker, CircuitOpenError, Resilience
+from scraper.utils.resolution import ProductLookupError, get_resolve_product_key
+from scraper.utils.schedule import update_change_rate
+from scraper.utils.wildberries_client import WildberriesClient
+
+from config.celery import resolve_comment_product
+
+
+class FlakyWildberries(FakeWildberries):
+    """Answers the first requests with the given error statuses, then recovers."""
+
+    def __init__(self, statuses=(), **kwargs):
+        super().__init__(**kwargs)
+        self.statuses = list(statuses)
+
+    def handle(self, method, path, headers):
+        with self._lock:
+            status = self.statuses.pop(0) if self.statuses else None
+        if status:
+            return status, {"Retry-After": str(self.retry_after)}, b""
+        return super().handle(method, path, headers)
+
+
+class AsyncFetcherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.running = self.peak = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, url):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return url.upper()
+
+    def test_runs_up_to_the_configured_concurrency(self):
+        fetcher = AsyncFetcher(self.fetch, concurrency=48, per_host_concurrency=48)
+        urls = [f"https://a.test/{index}" for index in range(96)]
+
+        results = fetcher.fetch_many(urls)
+
+        self.assertEqual(results[urls[0]], urls[0].upper())
+        self.assertEqual(len(results), 96)
+        self.assertEqual(self.peak, 48)
+
+    def test_limits_requests_per_host(self):
+        fetcher = AsyncFetcher(self.fetch, concurrency=48, per_host_concurrency=2)
+
+        fetcher.fetch_many(f"https://a.test/{index}" for index in range(8))
+
+        self.assertEqual(self.peak, 2)
+
+
+class WildberriesClientTestCase(TestCase):
+    """Runs a fresh client against a local fake Wildberries.
+
+    Redis keys and cache entries of every test live under their own prefix
+    and are removed afterwards.
+    """
+
+    def setUp(self):
+        self.fake = self.get_fake()
+        self.server = FakeWildberriesServer(self.fake).start()
+        self.addCleanup(self.server.stop)
+
+        key_prefix = f"test:{uuid.uuid4().hex}"
+        override = override_settings(
+            WB_UPSTREAM_URL=self.server.url,
+            WB_RATE_LIMITS={},
+            WB_RATE_LIMIT_DEFAULT=1000,
+            WB_RETRY_BACKOFF_BASE=0.01,
+            WB_REDIS_KEY_PREFIX=f"{key_prefix}:wb",
+            CACHES={
+                "default": {**settings.CACHES["default"], "KEY_PREFIX": key_prefix}
+            },
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self.delete_keys, key_prefix)
+
+        self.wildberries = WildberriesClient()
+        menu_category = self.fake.categories[0]
+        self.category = Category.objects.create(
+            title=menu_category.name,
+            source_id=menu_category.id,
+            slug_name=menu_category.url,
+            shard=menu_category.shard,
+        )
+
+    def get_fake(self):
+        return FakeWildberries(catalog_pages=3, products_per_page=5, seed=1)
+
+    @staticmethod
+    def delete_keys(key_prefix):
+        redis = get_redis_connection("default")
+        keys = list(redis.scan_iter(f"{key_prefix}:*"))
+        if keys:
+            redis.delete(*keys)
+
+
+class RetryTestCase(WildberriesClientTestCase):
+    def get_fake(self):
+        return FlakyWildberries(statuses=[503, 429], retry_after=1, seed=1)
+
+    def test_recovers_after_server_error_and_throttling(self):
+        started_at = time.monotonic()
+        data = self.wildberries.send_request(
+            self.wildberries.get_catalog_url(self.category)
+        )
+
+        self.assertTrue(data["data"]["products"])
+        self.assertEqual(self.fake.responses[503], 1)
+        self.assertEqual(self.fake.responses[429], 1)
+        self.assertEqual(self.fake.responses[200], 1)
+        self.assertEqual(self.wildberries.resilience.retries, 2)
+        # The host is blocked for the Retry-After period of the throttling
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.9)
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+
+    def open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_one_trial_request_after_the_reset_timeout(self):
+        self.open()
+        time.sleep(0.06)
+
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record_success()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_opens_the_breaker_again(self):
+        self.open()
+        time.sleep(0.06)
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+
+        self.assertTrue(self.breaker.is_open)
+        self.assertEqual(self.breaker.trips, 2)
+
+    def test_catalog_shards_have_their_own_breakers(self):
+        get_key = Resilience.get_breaker_key
+
+        self.assertEqual(
+            get_key("https://catalog.wb.ru/catalog/dresses/v2/catalog?page=1"),
+            "catalog.wb.ru/dresses",
+        )
+        self.assertNotEqual(
+            get_key("https://catalog.wb.ru/catalog/shoes/v2/catalog"),
+            get_key("https://catalog.wb.ru/catalog/dresses/v2/catalog"),
+        )
+        self.assertEqual(get_key("https://card.wb.ru/cards/v2/detail"), "card.wb.ru")
+
+
+class CatalogTestCase(WildberriesClientTestCase):
+    def test_reads_pages_until_an_empty_one(self):
+        pages = list(self.wildberries.iter_catalog(self.category))
+
+        self.assertEqual([len(page) for page in pages], [5, 5, 5])
+        self.assertEqual(self.fake.requests["catalog.wb.ru"], 4)
+
+    def test_stops_after_a_page_of_known_products(self):
+        first_page = self.fake.get_catalog({"cat": str(self.category.source_id)})
+        known_source_ids = {product["id"] for product in first_page["data"]["products"]}
+
+        pages = list(self.wildberries.iter_catalog(self.category, known_source_ids))
+
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(self.fake.requests["catalog.wb.ru"], 1)
+
+    def test_stops_at_the_product_limit(self):
+        pages = list(self.wildberries.iter_catalog(self.category, max_products=7))
+
+        self.assertEqual([len(page) for page in pages], [5, 2])
+
+    def test_stops_at_the_page_limit(self):
+        pages = list(self.wildberries.iter_catalog(self.category, max_pages=2))
+
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(self.fake.requests["catalog.wb.ru"], 2)
+
+    def test_reuses_the_fetched_first_page(self):
+        first_page = self.fake.get_catalog({"cat": str(self.category.source_id)})
+
+        pages = list(
+            self.wildberries.iter_catalog(self.category, first_page=first_page)
+        )
+
+        self.assertEqual(pages[0], first_page["data"]["products"])
+        self.assertEqual(len(pages), 3)
+        # Pages 2 and 3 and the empty page after them
+        self.assertEqual(self.fake.requests["catalog.wb.ru"], 3)
+
+    def test_get_products_saves_the_catalog(self):
+        report = self.wildberries.get_products([self.category], set())
+
+        self.assertEqual(report["inserted"], 15)
+        self.assertEqual(report["failed"], 0)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.product_count, 15)
+        self.assertIsNotNone(self.category.scraped_at)
+
+
+class SyncCategoriesTestCase(TestCase):
+    def setUp(self):
+        self.women = Category.objects.create(title="Women", source_id=1)
+        self.menu = CategoryMenu(
+            [
+                (1, "Women", "/catalog/women", "", None),
+                (11, "Dresses", "/catalog/women/dresses", "dresses", 1),
+                (12, "Shoes", "/catalog/women/shoes", "shoes", 1),
+                (2, "Men", "/catalog/men", "", None),
+                (21, "Shirts", "/catalog/men/shirts", "shirts", 2),
+            ]
+        )
+
+    def test_creates_the_subcategories_of_known_categories(self):
+        report = sync_categories(self.menu)
+
+        self.assertEqual(report["created"], 2)
+        self.assertEqual(
+            set(self.women.sub_categories.values_list("source_id", "title", "shard")),
+            {(11, "Dresses", "dresses"), (12, "Shoes", "shoes")},
+        )
+        self.assertFalse(Category.objects.filter(source_id=21).exists())
+
+        report = sync_categories(self.menu)
+
+        self.assertEqual(report["created"], 0)
+        self.assertEqual(report["unchanged"], 2)
+
+    def test_renames_and_reparents_existing_subcategories(self):
+        shoes = Category.objects.create(title="Boots", source_id=12)
+
+        report = sync_categories(self.menu)
+
+        self.assertEqual(report["renamed"], 1)
+        self.assertEqual(report["reparented"], 1)
+        shoes.refresh_from_db()
+        self.assertEqual(shoes.title, "Shoes")
+        self.assertEqual(shoes.parent, self.women)
+
+    def test_taken_title_gets_the_parent_title(self):
+        Category.objects.create(title="Dresses")
+        Category.objects.create(title="Dresses Women", source_id=99)
+        Category.objects.create(title="Shoes")
+
+        report = sync_categories(self.menu)
+
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(Category.objects.get(source_id=12).title, "Shoes Women")
+        self.assertFalse(Category.objects.filter(source_id=11).exists())
+
+
+class FindBreadcrumbSlugTestCase(SimpleTestCase):
+    page = (
+        '<html><body><a class="breadcrumbs__link" href="/ad">Ad</a>'
+        '<div class="product-page"><ul>'
+        '<li><a class="breadcrumbs__link" href="/">Main</a></li>'
+        '<li><a class="breadcrumbs__link" href="/catalog/women">Women</a></li>'
+        "</ul></div><p>Description</p></body></html>"
+    )
+
+    def get_chunks(self, page, size=16):
+        self.read = 0
+        while page:
+            chunk, page = page[:size], page[size:]
+            self.read += 1
+            yield chunk.encode()
+
+    def test_returns_the_link_at_the_position(self):
+        self.assertEqual(
+            find_breadcrumb_slug(self.get_chunks(self.page)), "/catalog/women"
+        )
+        self.assertEqual(find_breadcrumb_slug(self.get_chunks(self.page), 0), "/")
+
+    def test_stops_reading_at_the_breadcrumb(self):
+        find_breadcrumb_slug(self.get_chunks(self.page))
+
+        self.assertLess(self.read, len(self.page) // 16)
+
+    def test_page_without_a_breadcrumb(self):
+        page = self.page.replace("product-page", "promo")
+
+        self.assertIsNone(find_breadcrumb_slug(self.get_chunks(page)))
+
+
+class ProductCategoryTestCase(WildberriesClientTestCase):
+    def test_reads_the_category_from_the_product_page(self):
+        source_id = self.fake.get_product_id(0, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(
+                self.wildberries.get_product_category(source_id), self.category
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.wildberries.get_product_category(source_id), self.category
+            )
+
+    def test_unknown_product_has_no_category(self):
+        self.assertIsNone(self.wildberries.get_product_category(5))
+
+
+class CategorySourceTestCase(WildberriesClientTestCase):
+    def get_menu_requests(self) -> int:
+        return self.fake.requests["static-basket-01.wb.ru"]
+
+    def test_menu_is_fetched_once_per_interval(self):
+        menu = self.wildberries.category_source.get_menu()
+
+        self.assertEqual(menu.get(self.category.source_id).name, self.category.title)
+        self.assertIs(self.wildberries.category_source.get_menu(), menu)
+        # Another process reads the menu from the shared cache
+        self.assertIsNotNone(CategorySource(self.wildberries).get_menu())
+        self.assertEqual(self.get_menu_requests(), 1)
+
+    def test_unchanged_menu_is_revalidated(self):
+        self.wildberries.category_source.get_menu()
+
+        with override_settings(WB_CATEGORY_MENU_REFRESH_SECONDS=0):
+            menu = CategorySource(self.wildberries).get_menu()
+
+        self.assertIsNotNone(menu.get(self.category.source_id))
+        self.assertEqual(self.get_menu_requests(), 2)
+        self.assertEqual(self.fake.responses[304], 1)
+
+
+class UpsertProductsTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title="Dresses", source_id=1)
+        self.known = Product.objects.create(title="Known", source_id=1)
+
+    def get_page(self, *names):
+        return [
+            {"id": index, "name": name, "root": index * 10}
+            for index, name in enumerate(names, start=1)
+        ]
+
+    def test_inserts_new_and_refreshes_known_products(self):
+        report = upsert_products(self.category, self.get_page("Known", "Fresh"))
+
+        self.assertEqual(report, {"inserted": 1, "updated": 1, "skipped": 0})
+        self.known.refresh_from_db()
+        self.assertEqual(self.known.root, 10)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.product_count, 1)
+
+    def test_skips_incomplete_repeated_and_taken_rows(self):
+        Product.objects.create(title="Taken", source_id=100)
+        page = self.get_page("Known", "Taken", "Fresh", "Fresh", None)
+
+        report = upsert_products(self.category, [*page, page[0]])
+
+        self.assertEqual(report, {"inserted": 1, "updated": 1, "skipped": 4})
+        self.assertEqual(Product.objects.get(title="Fresh").source_id, page[2]["id"])
+
+    def test_title_taken_by_a_concurrent_writer_skips_only_its_row(self):
+        bulk_create = Product.objects.bulk_create
+
+        def take_title(objects, **kwargs):
+            # Another worker takes the title after the page was checked
+            Product.objects.get_or_create(source_id=100, defaults={"title": "Taken"})
+            return bulk_create(objects, **kwargs)
+
+        with mock.patch.object(Product.objects, "bulk_create", take_title):
+            report = upsert_products(
+                self.category, self.get_page("Known", "Taken", "Fresh")
+            )
+
+        self.assertEqual(report, {"inserted": 1, "updated": 1, "skipped": 1})
+        self.known.refresh_from_db()
+        self.assertEqual(self.known.root, 10)
+        self.assertTrue(Product.objects.filter(source_id=3, title="Fresh").exists())
+        self.assertFalse(Product.objects.filter(source_id=2).exists())
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.product_count, 1)
+
+
+class BasketTestCase(WildberriesClientTestCase):
+    def get_photo_id(self, volume, index=0) -> str:
+        return f"{volume}00{index:03d}0"
+
+    def test_resolves_the_basket_of_a_photo(self):
+        volume = 4321
+        url = self.wildberries.baskets.resolve(self.get_photo_id(volume))
+
+        self.assertEqual(
+            urlparse(url).netloc,
+            f"feedback{self.fake.get_basket(volume):02d}.wbbasket.ru",
+        )
+
+    def test_learned_volume_costs_a_single_probe(self):
+        volume = 4321
+        self.wildberries.baskets.resolve(self.get_photo_id(volume))
+        probes = self.wildberries.baskets.probes
+
+        self.wildberries.baskets.resolve(self.get_photo_id(volume, 1))
+
+        self.assertEqual(self.wildberries.baskets.probes, probes + 1)
+        self.assertEqual(self.wildberries.baskets.hits, 1)
+
+    def test_unknown_volume_tries_the_basket_of_its_neighbours_first(self):
+        self.wildberries.baskets.resolve(self.get_photo_id(4321))
+        probes = self.wildberries.baskets.probes
+
+        self.wildberries.baskets.resolve(self.get_photo_id(4325))
+
+        self.assertEqual(self.wildberries.baskets.probes, probes + 1)
+        self.assertEqual(self.wildberries.baskets.hits, 1)
+
+    def test_learned_volumes_are_shared_between_clients(self):
+        self.wildberries.baskets.resolve(self.get_photo_id(4321))
+        baskets = WildberriesClient().baskets
+
+        baskets.resolve(self.get_photo_id(4321, 1))
+
+        self.assertEqual(baskets.probes, 1)
+        self.assertEqual(baskets.hits, 1)
+
+    def test_photo_outside_the_known_baskets_is_not_resolved(self):
+        self.fake.baskets = settings.WB_FEEDBACK_BASKETS * 2
+
+        self.assertIsNone(self.wildberries.baskets.resolve(self.get_photo_id(9999)))
+
+
+class FeedbackCursorTestCase(WildberriesClientTestCase):
+    def get_fake(self):
+        return FakeWildberries(feedbacks_per_root=5, photos_per_feedback=1, seed=1)
+
+    def setUp(self):
+        super().setUp()
+        self.root = self.fake.get_root(self.fake.get_product_id(0, 0))
+        self.product = Product.objects.create(
+            title="Product", source_id=self.root, root=self.root
+        )
+
+    def test_skips_feedbacks_up_to_the_cursor(self):
+        report = self.wildberries.get_product_comments([self.root])
+
+        # Every fifth feedback of the fake is rated 4 and filtered out
+        self.assertEqual(report["inserted"], 4)
+        cursor = FeedbackCursor.objects.get(root=self.root)
+        self.assertIsNotNone(cursor.last_feedback_date)
+
+        report = self.wildberries.get_product_comments([self.root])
+
+        self.assertEqual(report.get("inserted", 0), 0)
+        self.assertEqual(report.get("duplicates", 0), 0)
+        self.assertEqual(self.fake.requests["feedbacks2.wb.ru"], 2)
+        self.assertEqual(Comment.objects.filter(product=self.product).count(), 4)
+        self.assertEqual(
+            CommentFiles.objects.filter(comment__product=self.product).count(), 4
+        )
+
+
+class AdvanceFeedbackCursorsTestCase(TestCase):
+    root = 100
+
+    def get_feedback(self, feedback_id, day):
+        return {"id": feedback_id, "createdDate": f"2024-01-{day:02d}T12:00:00+00:00"}
+
+    def advance(self, feedbacks, unresolved=None) -> FeedbackCursor:
+        advance_feedback_cursors(
+            {self.root: feedbacks}, get_feedback_cursors([self.root]), unresolved
+        )
+        return FeedbackCursor.objects.get(root=self.root)
+
+    def test_moves_to_the_latest_feedback(self):
+        cursor = self.advance([self.get_feedback("a", 1), self.get_feedback("c", 3)])
+
+        self.assertEqual(cursor.last_feedback_id, "c")
+        self.assertIsNotNone(cursor.checked_at)
+
+        cursor = self.advance([self.get_feedback("b", 2)])
+
+        self.assertEqual(cursor.last_feedback_id, "c")
+
+    def test_stays_below_unresolved_feedbacks(self):
+        feedbacks = [
+            self.get_feedback("a", 1),
+            self.get_feedback("b", 2),
+            self.get_feedback("c", 3),
+        ]
+
+        cursor = self.advance(feedbacks, unresolved={"b"})
+
+        self.assertEqual(cursor.last_feedback_id, "a")
+        self.assertEqual(select_new_feedbacks(feedbacks, cursor), feedbacks[1:])
+
+    def test_keeps_other_feedbacks_of_the_cursor_date(self):
+        cursor = FeedbackCursor(
+            root=self.root,
+            last_feedback_id="b",
+            last_feedback_date=get_published_date(self.get_feedback("b", 2)),
+        )
+        feedbacks = [
+            self.get_feedback("a", 1),
+            self.get_feedback("b", 2),
+            self.get_feedback("x", 2),
+            self.get_feedback("c", 3),
+        ]
+
+        self.assertEqual(
+            [feedback["id"] for feedback in select_new_feedbacks(feedbacks, cursor)],
+            ["x", "c"],
+        )
+
+
+class IngestFeedbacksTestCase(WildberriesClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.fake.get_root(self.fake.get_product_id(0, 0))
+        self.product = Product.objects.create(
+            title="Product", source_id=self.root, root=self.root
+        )
+
+    def get_feedbacks(self, text="Отлично"):
+        feedbacks = self.fake.get_feedbacks(str(self.root))["feedbacks"]
+        # The fake rates every fifth feedback with 4 stars
+        feedbacks = [
+            feedback for feedback in feedbacks if feedback["productValuation"] == 5
+        ]
+        for feedback in feedbacks:
+            feedback["text"] = text
+        return feedbacks
+
+    def ingest(self, feedbacks):
+        return ingest_feedbacks(self.wildberries, {self.product.pk: feedbacks})
+
+    def test_feedbacks_with_the_same_text_are_kept_apart(self):
+        feedbacks = self.get_feedbacks()
+
+        report = self.ingest(feedbacks[:2])
+
+        self.assertEqual(report["inserted"], 2)
+        self.assertEqual(report["duplicates"], 0)
+
+        report = self.ingest(feedbacks[:3])
+
+        self.assertEqual(report["inserted"], 1)
+        self.assertEqual(report["duplicates"], 2)
+        self.assertEqual(Comment.objects.filter(product=self.product).count(), 3)
+
+    def test_repeated_feedback_is_a_duplicate(self):
+        feedback = self.get_feedbacks()[0]
+
+        report = self.ingest([feedback, feedback])
+
+        self.assertEqual(report["inserted"], 1)
+        self.assertEqual(report["duplicates"], 1)
+
+    def test_comment_without_an_id_matches_one_feedback_by_content(self):
+        feedbacks = self.get_feedbacks()
+        Comment.objects.bulk_create(
+            [
+                Comment(
+                    product=self.product,
+                    content="Отлично",
+                    content_hash=Comment.get_content_hash("Отлично"),
+                    rating=5,
+                )
+            ]
+        )
+
+        report = self.ingest(feedbacks[:2])
+
+        self.assertEqual(report["inserted"], 1)
+        self.assertEqual(report["duplicates"], 1)
+        # The old comment took over the id of the matched feedback
+        self.assertFalse(
+            Comment.objects.filter(product=self.product, source_id=None).exists()
+        )
+        self.assertCountEqual(
+            Comment.objects.filter(product=self.product).values_list(
+                "source_id", flat=True
+            ),
+            [get_feedback_source_id(feedback) for feedback in feedbacks[:2]],
+        )
+
+
+class ProductResolutionTestCase(WildberriesClientTestCase):
+    def get_fake(self):
+        return FlakyWildberries(seed=1)
+
+    def create_comment(self, source_id):
+        comment = Comment(
+            product_source_id=source_id,
+            content="Nice",
+            rating=5,
+            status=CommentStatuses.ACCEPTED,
+        )
+        Comment.objects.bulk_create([comment])
+        cache.set(get_resolve_product_key(source_id), True)
+        return comment
+
+    @staticmethod
+    def is_pending(source_id) -> bool:
+        return cache.get(get_resolve_product_key(source_id)) is not None
+
+    def test_attaches_the_found_product(self):
+        source_id = self.fake.get_product_id(0, 1)
+        comment = self.create_comment(source_id)
+
+        self.assertEqual(self.wildberries.resolve_comment_product(source_id), 1)
+
+        comment.refresh_from_db()
+        self.assertEqual(comment.product.source_id, source_id)
+        self.assertFalse(self.is_pending(source_id))
+
+    def test_deletes_the_comments_of_a_missing_article(self):
+        comment = self.create_comment(5)
+
+        self.assertEqual(self.wildberries.resolve_comment_product(5), 1)
+
+        self.assertFalse(Comment.objects.filter(pk=comment.pk).exists())
+        self.assertFalse(self.is_pending(5))
+
+    def test_failed_lookup_keeps_the_comments_and_the_pending_mark(self):
+        source_id = self.fake.get_product_id(0, 1)
+        comment = self.create_comment(source_id)
+        self.fake.statuses = [503] * 3
+
+        with self.assertRaises(ProductLookupError):
+            self.wildberries.resolve_comment_product(source_id)
+
+        comment.refresh_from_db()
+        self.assertIsNone(comment.product)
+        self.assertTrue(self.is_pending(source_id))
+
+    def test_task_keeps_the_pending_mark_until_it_gives_up(self):
+        source_id = self.fake.get_product_id(0, 1)
+        self.create_comment(source_id)
+        self.fake.statuses = [503] * 6
+
+        with self.assertRaises(ProductLookupError):
+            resolve_comment_product(source_id)
+        self.assertTrue(self.is_pending(source_id))
+
+        result = resolve_comment_product.apply(
+            (source_id,), retries=resolve_comment_product.max_retries
+        )
+
+        self.assertIsInstance(result.result, ProductLookupError)
+        self.assertFalse(self.is_pending(source_id))
+
+
+class TitleMatcherTestCase(SimpleTestCase):
+    def test_finds_titles_contained_in_the_text(self):
+        matcher = TitleMatcher({1: "Red Dress", 2: "dress", 3: "Blue Shirt"})
+
+        self.assertCountEqual(matcher.find("Long  RED dress, silk"), [1, 2])
+        self.assertEqual(matcher.find("Green shirt"), [])
+
+    def test_finds_overlapping_titles(self):
+        matcher = TitleMatcher({1: "abcd", 2: "bc", 3: "bcde"})
+
+        self.assertCountEqual(matcher.find("xabcde"), [1, 2, 3])
+
+    def test_ignores_empty_titles(self):
+        matcher = TitleMatcher({1: "", 2: None, 3: "hat"})
+
+        self.assertEqual(matcher.find("a hat"), [3])
+
+
+class UpdateProductsTestCase(WildberriesClientTestCase):
+    def create_pending(self, title):
+        return Product.objects.create(title=title, category=self.category)
+
+    def test_matches_pending_titles_against_one_catalog_fetch(self):
+        first = self.fake.get_product_id(0, 1)
+        second = self.fake.get_product_id(0, 3)
+        products = [
+            self.create_pending(f"Product {first}"),
+            self.create_pending(f"Product {second}"),
+            self.create_pending("Unlisted"),
+        ]
+
+        report = self.wildberries.update_products()
+
+        self.assertEqual(report, {"pending": 3, "matched": 2})
+        self.assertEqual(self.fake.requests["catalog.wb.ru"], 1)
+        for product in products:
+            product.refresh_from_db()
+        self.assertEqual(
+            [product.source_id for product in products], [first, second, None]
+        )
+
+    def test_taken_source_id_is_not_reused(self):
+        source_id = self.fake.get_product_id(0, 1)
+        Product.objects.create(title="Known", source_id=source_id)
+        product = self.create_pending(f"Product {source_id}")
+
+        report = self.wildberries.update_products()
+
+        self.assertEqual(report["matched"], 0)
+        product.refresh_from_db()
+        self.assertIsNone(product.source_id)
+
+
+class ChangeRateTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def test_first_scrape_does_not_change_the_rate(self):
+        self.assertEqual(update_change_rate(0.5, 100, None, self.now), 0.5)
+
+    def test_rate_blends_changes_per_hour(self):
+        scraped_at = self.now - timedelta(hours=2)
+
+        self.assertAlmostEqual(
+            update_change_rate(1.0, 10, scraped_at, self.now), 0.3 * 5 + 0.7 * 1.0
+        )
+
+
+class StaleCategoriesTestCase(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def create_category(self, title, hours=1, change_rate=0.0, product_count=500):
+        return Category.objects.create(
+            title=title,
+            source_id=len(title) * 1000 + Category.objects.count(),
+            shard="shard",
+            scraped_at=self.now - timedelta(hours=hours) if hours else None,
+            change_rate=change_rate,
+            product_count=product_count,
+        )
+
+    def get_titles(self, limit=10):
+        return [
+            category.title for category in WildberriesClient.get_stale_categories(limit)
+        ]
+
+    def test_never_scraped_categories_come_first(self):
+        self.create_category("old", hours=24)
+        self.create_category("new", hours=None)
+
+        self.assertEqual(self.get_titles(), ["new", "old"])
+
+    def test_volatile_categories_outrank_equally_stale_ones(self):
+        self.create_category("calm")
+        self.create_category("busy", change_rate=2.0)
+
+        self.assertEqual(self.get_titles(1), ["busy"])
+
+    def test_under_filled_categories_outrank_equally_stale_ones(self):
+        self.create_category("full")
+        self.create_category("half", product_count=50)
+        self.create_category("empty", product_count=0)
+        self.create_category("stale", hours=3)
+
+        self.assertEqual(self.get_titles(), ["stale", "empty", "half", "full"])
+
+    def test_categories_without_a_catalog_are_skipped(self):
+        self.create_category("listed")
+        Category.objects.create(title="menu only")
+
+        self.assertEqual(self.get_titles(), ["listed"])
+
+
+class StaleRootsTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for index, root in enumerate([10, 10, 20, 30, 40]):
+            Product.objects.create(title=f"Product {index}", root=root)
+        FeedbackCursor.objects.bulk_create(
+            [
+                FeedbackCursor(root=10, checked_at=now - timedelta(hours=1)),
+                FeedbackCursor(
+                    root=20, checked_at=now - timedelta(hours=1), change_rate=3.0
+                ),
+                FeedbackCursor(root=30),
+                # The products of this root are gone
+                FeedbackCursor(root=50, checked_at=now - timedelta(days=1)),
+            ]
+        )
+
+    def test_unchecked_roots_come_first_then_the_stalest(self):
+        self.assertEqual(WildberriesClient.get_stale_roots(), [30, 40, 20, 10])
+
+    def test_limit(self):
+        self.assertEqual(WildberriesClient.get_stale_roots(1), [30])
+        self.assertEqual(WildberriesClient.get_stale_roots(3), [30, 40, 20])
+
+
+class BackfillProductImageLinksTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(title="Product", source_id=1)
+
+    def create_comment(
+        self, product, status=CommentStatuses.ACCEPTED, links=(), **kwargs
+    ):
+        comment = Comment(
+            product=product, content="Nice", rating=5, status=status, **kwargs
+        )
+        Comment.objects.bulk_create([comment])
+        CommentFiles.objects.bulk_create(
+            CommentFiles(
+                comment=comment, file_link=link, file_type=FileTypeChoices.IMAGE
+            )
+            for link in links
+        )
+        return comment
+
+    def test_uses_the_first_image_of_the_first_accepted_comment(self):
+        self.create_comment(
+            self.product, CommentStatuses.NOT_ACCEPTED, ["https://x/rejected.webp"]
+        )
+        self.create_comment(self.product)
+        self.create_comment(
+            self.product, links=["https://x/first.webp", "https://x/second.webp"]
+        )
+        self.create_comment(self.product, links=["https://x/later.webp"])
+
+        self.assertEqual(backfill_product_image_links(batch_size=1), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_link, "https://x/first.webp")
+
+    def test_prefers_the_own_image_of_a_comment(self):
+        self.create_comment(
+            self.product,
+            links=["https://x/linked.webp"],
+            file="comments/own.webp",
+            file_type=FileTypeChoices.IMAGE,
+        )
+
+        backfill_product_image_links()
+
+        self.product.refresh_from_db()
+        self.assertEqual(
+            self.product.image_link, default_storage.url("comments/own.webp")
+        )
+
+    def test_fills_every_batch(self):
+        other = Product.objects.create(title="Other", source_id=2)
+        Product.objects.create(title="Without comments", source_id=3)
+        self.create_comment(self.product, links=["https://x/first.webp"])
+        self.create_comment(other, links=["https://x/other.webp"])
+
+        self.assertEqual(backfill_product_image_links(batch_size=1), 2)
+        other.refresh_from_db()
+        self.assertEqual(other.image_link, "https://x/other.webp")
+
+    def test_keeps_existing_images(self):
+        other = Product.objects.create(
+            title="Other", source_id=2, image_link="https://x/kept.webp"
+        )
+        self.create_comment(other, links=["https://x/new.webp"])
+
+        self.assertEqual(backfill_product_image_links(), 0)
+        other.refresh_from_db()
+        self.assertEqual(other.image_link, "https://x/kept.webp")
@@ -0,0 +1,126 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+BASKET_HOSTS_KEY = "feedback_basket_hosts"
+# Returned for a photo that was not found while some basket could not be checked
+UNRESOLVED = object()
+
+
+class BasketResolver:
+    """Predicts the ``feedbackNN.wbbasket.ru`` host that stores a comment photo.
+
+    Wildberries spreads photo volumes over basket hosts in contiguous ranges.
+    Every successful probe teaches the resolver the basket of a volume; the
+    mapping is shared through Redis, so later photos of a known volume cost a
+    single request and photos of an unknown volume try the baskets of the
+    neighbouring known volumes first. All baskets are probed only as a last
+    resort.
+    """
+
+    def __init__(self, check):
+        self.check = check
+        self.baskets = list(range(1, settings.WB_FEEDBACK_BASKETS + 1))
+        self._volumes = {}
+        self._sorted_volumes = []
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.probes = 0
+
+    @staticmethod
+    def get_mapping_key() -> str:
+        return f"{settings.WB_REDIS_KEY_PREFIX}:{BASKET_HOSTS_KEY}"
+
+    @staticmethod
+    def get_image_url(basket_id, photo_id: str) -> str:
+        return (
+            f"https://feedback{basket_id:02d}.wbbasket.ru/vol{photo_id[:4]}"
+            f"/part{photo_id[:6]}/{photo_id}/photos/ms.webp"
+        )
+
+    def resolve(self, photo_id):
+        """Returns the URL of the photo on its basket host.
+
+        ``None`` means no basket has the photo, ``UNRESOLVED`` that it was
+        not found but some basket could not be checked.
+        """
+        photo_id = str(photo_id)
+        volume = int(photo_id[:4])
+        predicted, candidates = self.get_candidates(volume)
+
+        unknown = False
+        for attempt, basket_id in enumerate(candidates):
+            url = self.get_image_url(basket_id, photo_id)
+            self.probes += 1
+            found = self.check(url)
+            if found:
+                self.lookups += 1
+                if predicted and attempt == 0:
+                    self.hits += 1
+                self.learn(volume, basket_id)
+                return url
+            unknown = unknown or found is None
+        self.lookups += 1
+        return UNRESOLVED if unknown else None
+
+    def get_candidates(self, volume) -> tuple[bool, list[int]]:
+        """Returns whether a prediction exists and the baskets to probe in order."""
+        self.load()
+        with self._lock:
+            if volume in self._volumes:
+                preferred = [self._volumes[volume]]
+            else:
+                index = bisect.bisect_left(self._sorted_volumes, volume)
+                start, end = max(index - 1, 0), index + 1
+                neighbours = self._sorted_volumes[start:end]
+                preferred = [self._volumes[neighbour] for neighbour in neighbours]
+        preferred = list(dict.fromkeys(preferred))
+        rest = [basket_id for basket_id in self.baskets if basket_id not in preferred]
+        return bool(preferred), preferred + rest
+
+    def learn(self, volume, basket_id):
+        with self._lock:
+            if self._volumes.get(volume) == basket_id:
+                return
+            if volume not in self._volumes:
+                bisect.insort(self._sorted_volumes, volume)
+            self._volumes[volume] = basket_id
+        try:
+            get_redis_connection("default").hset(
+                self.get_mapping_key(), volume, basket_id
+            )
+        except RedisError:
+            pass
+
+    def load(self, force=False):
+        """Refreshes the learned mapping from Redis at most once per interval."""
+        if (
+            not force
+            and time.monotonic() - self._loaded_at
+            < settings.WB_BASKET_MAPPING_REFRESH_SECONDS
+        ):
+            return
+        self._loaded_at = time.monotonic()
+        try:
+            mapping = get_redis_connection("default").hgetall(self.get_mapping_key())
+        except RedisError:
+            return
+        with self._lock:
+            for volume, basket_id in mapping.items():
+                self._volumes[int(volume)] = int(basket_id)
+            self._sorted_volumes = sorted(self._volumes)
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "probes": self.probes,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "known_volumes": len(self._volumes),
+        }
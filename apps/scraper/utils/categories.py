@@ -0,0 +1,331 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+import requests
+from core.metrics import metrics
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from lxml import etree
+from scraper.models import Category, Product
+
+CATEGORIES_FIXTURE_PATH = os.path.join(
+    settings.BASE_DIR, "apps", "scraper", "fixtures", "categories.json"
+)
+CATEGORY_MENU_URL = "https://static-basket-01.wb.ru/vol0/data/main-menu-ru-ru-v2.json"
+CATEGORY_MENU_CACHE_KEY = "wb:category_menu"
+CATEGORY_SLUG_CACHE_KEY = "wb:category_slug"
+
+MenuCategory = namedtuple("MenuCategory", ["id", "name", "url", "shard", "parent"])
+
+
+def load_fixture_categories() -> list[dict]:
+    with open(CATEGORIES_FIXTURE_PATH, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def flatten_category_tree(categories) -> list[MenuCategory]:
+    """Flattens a Wildberries category tree into compact rows."""
+    rows = []
+    stack = [(category, None) for category in reversed(categories)]
+    while stack:
+        category, parent_id = stack.pop()
+        rows.append(
+            MenuCategory(
+                category["id"],
+                category.get("name"),
+                category.get("url", ""),
+                category.get("shard", ""),
+                category.get("parent", parent_id),
+            )
+        )
+        stack.extend(
+            (child, category["id"]) for child in reversed(category.get("childs", []))
+        )
+    return rows
+
+
+def normalize_slug(slug_name: str) -> str:
+    return urlparse(slug_name or "").path.rstrip("/")
+
+
+class CategoryMenu:
+    """Parsed category menu with lookups by id, slug and parent."""
+
+    def __init__(self, rows):
+        self.rows = [MenuCategory(*row) for row in rows]
+        self.by_id = {row.id: row for row in self.rows}
+        self.by_slug = {}
+        self.by_parent = {}
+        for row in self.rows:
+            self.by_slug.setdefault(normalize_slug(row.url), row)
+            self.by_parent.setdefault(row.parent, []).append(row)
+
+    def get(self, category_id) -> MenuCategory | None:
+        return self.by_id.get(category_id)
+
+    def get_by_slug(self, slug_name) -> MenuCategory | None:
+        return self.by_slug.get(normalize_slug(slug_name))
+
+    def top_level(self) -> list[MenuCategory]:
+        return self.by_parent.get(None, [])
+
+    def children(self, category_id) -> list[MenuCategory]:
+        return self.by_parent.get(category_id, [])
+
+
+def get_classes(element) -> list[str]:
+    return (element.get("class") or "").split()
+
+
+def find_breadcrumb_slug(chunks, position=1) -> str | None:
+    """Returns the link of a product page breadcrumb, reading only up to it.
+
+    The HTML chunks are fed to a pull parser, so the rest of the page is
+    neither downloaded nor parsed once the breadcrumb is found.
+    """
+    parser = etree.HTMLPullParser(events=("start",))
+    in_product_page = False
+    links = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            if element.tag == "div" and "product-page" in get_classes(element):
+                in_product_page = True
+            elif (
+                in_product_page
+                and element.tag == "a"
+                and "breadcrumbs__link" in get_classes(element)
+            ):
+                if links == position:
+                    return element.get("href")
+                links += 1
+    return None
+
+
+class CategoryCache:
+    """Categories by slug.
+
+    Entries are kept in process and in the shared cache, so repeated
+    lookups do not hit the database.
+    """
+
+    def __init__(self):
+        self._categories = {}
+
+    def get(self, slug_name) -> Category | None:
+        slug_name = normalize_slug(slug_name)
+        category = self._categories.get(slug_name)
+        if category is None:
+            category = cache.get(f"{CATEGORY_SLUG_CACHE_KEY}:{slug_name}")
+            if category is not None:
+                self._categories[slug_name] = category
+        return category
+
+    def set(self, slug_name, category: Category):
+        slug_name = normalize_slug(slug_name)
+        self._categories[slug_name] = category
+        cache.set(
+            f"{CATEGORY_SLUG_CACHE_KEY}:{slug_name}",
+            category,
+            timeout=settings.WB_CATEGORY_CACHE_SECONDS,
+        )
+
+
+class CategorySource:
+    """Keeps the parsed category menu in process and in Redis.
+
+    The fixture menu is parsed once per process. The remote menu is stored in
+    the shared cache in compact form and refreshed at most once per interval
+    with a conditional request, so an unchanged menu costs a ``304``.
+    """
+
+    def __init__(self, client, url=CATEGORY_MENU_URL):
+        self.client = client
+        self.url = url
+        self._fixture_menu = None
+        self._menu = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get_fixture_menu(self) -> CategoryMenu:
+        if self._fixture_menu is None:
+            self._fixture_menu = CategoryMenu(
+                flatten_category_tree(load_fixture_categories())
+            )
+        return self._fixture_menu
+
+    def get_menu(self) -> CategoryMenu | None:
+        """Returns the remote menu, refreshing it when the interval has passed."""
+        with self._lock:
+            if (
+                self._menu is None
+                or time.monotonic() - self._checked_at
+                >= settings.WB_CATEGORY_MENU_REFRESH_SECONDS
+            ):
+                self._checked_at = time.monotonic()
+                self.refresh()
+            return self._menu
+
+    def refresh(self):
+        meta = cache.get(f"{CATEGORY_MENU_CACHE_KEY}:meta") or {}
+        if meta.get("version") and meta["version"] != self._version:
+            rows = cache.get(f"{CATEGORY_MENU_CACHE_KEY}:rows")
+            if rows:
+                self._menu = CategoryMenu(rows)
+                self._version = meta["version"]
+
+        if (
+            self._menu is not None
+            and time.time() - meta.get("checked_at", 0)
+            < settings.WB_CATEGORY_MENU_REFRESH_SECONDS
+        ):
+            return
+
+        headers = {}
+        if self._menu is not None and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if self._menu is not None and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            response = self.client.get(self.url, headers=headers)
+        except requests.exceptions.RequestException:
+            return
+
+        if response.status_code == 304:
+            meta["checked_at"] = time.time()
+            cache.set(f"{CATEGORY_MENU_CACHE_KEY}:meta", meta, timeout=None)
+            return
+        if response.status_code != 200:
+            return
+        try:
+            rows = [tuple(row) for row in flatten_category_tree(response.json())]
+        except (requests.exceptions.JSONDecodeError, KeyError, TypeError):
+            return
+
+        version = response.headers.get("ETag") or str(time.time())
+        cache.set(f"{CATEGORY_MENU_CACHE_KEY}:rows", rows, timeout=None)
+        cache.set(
+            f"{CATEGORY_MENU_CACHE_KEY}:meta",
+            {
+                "version": version,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "checked_at": time.time(),
+            },
+            timeout=None,
+        )
+        self._menu = CategoryMenu(rows)
+        self._version = version
+
+
+@metrics.timed("scraper_db_write_seconds", operation="sync_categories")
+def sync_categories(menu: CategoryMenu) -> dict:
+    """Brings the subcategories of known top-level categories in line with the menu.
+
+    All categories are loaded in a single query and compared with the menu
+    index; creates are applied with ``bulk_create`` and renames or reparents
+    with ``bulk_update``. Titles are unique, so a title that belongs to
+    another category gets the parent title appended, as before.
+    """
+    report = {"created": 0, "renamed": 0, "reparented": 0, "unchanged": 0, "skipped": 0}
+    categories = {
+        category.source_id: category
+        for category in Category.objects.only("id", "source_id", "title", "parent_id")
+        if category.source_id
+    }
+    taken_titles = {
+        category.title: category.source_id for category in categories.values()
+    }
+    taken_titles.update(
+        Category.objects.filter(source_id__isnull=True, title__isnull=False)
+        .values_list("title", "source_id")
+        .iterator()
+    )
+
+    creates = []
+    updates = {}
+    for top_category in menu.top_level():
+        parent = categories.get(top_category.id)
+        if not parent:
+            continue
+
+        for source in menu.children(top_category.id):
+            title = source.name
+            if title in taken_titles and taken_titles[title] != source.id:
+                title = f"{source.name} {parent.title}"
+            if title in taken_titles and taken_titles[title] != source.id:
+                report["skipped"] += 1
+                continue
+
+            category = categories.get(source.id)
+            if not category:
+                creates.append(
+                    Category(
+                        source_id=source.id,
+                        title=title,
+                        slug_name=source.url,
+                        shard=source.shard,
+                        parent=parent,
+                    )
+                )
+                taken_titles[title] = source.id
+                report["created"] += 1
+                continue
+
+            changed = False
+            if category.title != title:
+                taken_titles.pop(category.title, None)
+                taken_titles[title] = source.id
+                category.title = title
+                report["renamed"] += 1
+                changed = True
+            if category.parent_id != parent.id:
+                category.parent_id = parent.id
+                report["reparented"] += 1
+                changed = True
+            if changed:
+                updates[category.pk] = category
+            else:
+                report["unchanged"] += 1
+
+    try:
+        with transaction.atomic():
+            Category.objects.bulk_create(creates)
+            Category.objects.bulk_update(updates.values(), ["title", "parent"])
+    except IntegrityError:
+        # A title swap or a concurrent writer broke uniqueness; apply row by row
+        for category in [*creates, *updates.values()]:
+            try:
+                with transaction.atomic():
+                    category.save()
+            except IntegrityError:
+                report["skipped"] += 1
+    return report
+
+
+def add_category_products(category_id, count):
+    """Bumps the maintained product counter of a category."""
+    if category_id and count:
+        Category.objects.filter(pk=category_id).update(
+            product_count=F("product_count") + count
+        )
+
+
+def recount_category_products() -> int:
+    """Recomputes every category's product counter in a single statement."""
+    counts = (
+        Product.objects.filter(category=OuterRef("pk"))
+        .order_by()
+        .values("category")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return Category.objects.update(product_count=Coalesce(Subquery(counts), 0))
@@ -0,0 +1,291 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from scraper.utils.categories import flatten_category_tree, load_fixture_categories
+
+PRODUCT_ID_BASE = 1_000_000
+CATEGORY_MENU_ETAG = '"fake-menu"'
+
+
+def get_int(value) -> int:
+    return int(value) if value and value.isdigit() else 0
+
+
+class FakeWildberries:
+    """Synthetic Wildberries data and faults, served by ``FakeWildberriesServer``.
+
+    Routes are addressed as ``/<host>/<path>``, the form produced by the
+    ``WB_UPSTREAM_URL`` setting of the client. Every category of the menu has
+    ``catalog_pages`` pages of products, products are grouped into roots of
+    ``variants_per_root`` and every root has ``feedbacks_per_root`` feedbacks
+    with photos on predictable basket hosts. Responses recorded under
+    ``fixtures_dir`` as ``<host>/<path>`` (optionally suffixed with
+    ``@<query>``) are replayed instead of the synthetic ones.
+    """
+
+    def __init__(
+        self,
+        menu=None,
+        fixtures_dir=None,
+        catalog_pages=3,
+        products_per_page=100,
+        variants_per_root=4,
+        feedbacks_per_root=10,
+        photos_per_feedback=2,
+        baskets=10,
+        latency=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        retry_after=1,
+        seed=None,
+    ):
+        self.menu = menu if menu is not None else load_fixture_categories()
+        self.categories = flatten_category_tree(self.menu)
+        self.category_positions = {
+            category.id: position for position, category in enumerate(self.categories)
+        }
+        self.fixtures_dir = fixtures_dir
+        self.catalog_pages = catalog_pages
+        self.products_per_page = products_per_page
+        self.variants_per_root = variants_per_root
+        self.feedbacks_per_root = feedbacks_per_root
+        self.photos_per_feedback = photos_per_feedback
+        self.baskets = baskets
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        # Feedback dates are fixed, as they are for a real root
+        self.created_at = datetime.now(timezone.utc)
+        self.requests = Counter()
+        self.responses = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def handle(self, method, path, headers) -> tuple[int, dict, bytes]:
+        """Returns the status, headers and body of a response to the request."""
+        parsed_path = urlparse(path)
+        host, _, route = parsed_path.path.lstrip("/").partition("/")
+        route = f"/{route}"
+        query = {key: values[0] for key, values in parse_qs(parsed_path.query).items()}
+        with self._lock:
+            self.requests[host] += 1
+            fault = self._random.random()
+
+        if self.latency:
+            time.sleep(self.latency)
+        if fault < self.throttle_rate:
+            return 429, {"Retry-After": str(self.retry_after)}, b""
+        if fault < self.throttle_rate + self.error_rate:
+            return 503, {}, b""
+
+        recorded = self.get_recorded(host, route, parsed_path.query)
+        if recorded is not None:
+            return 200, {"Content-Type": "application/json"}, recorded
+
+        if host == "static-basket-01.wb.ru" and route.endswith(".json"):
+            return self.get_menu(headers)
+        if host == "catalog.wb.ru" and route.endswith("/catalog"):
+            return self.json(self.get_catalog(query))
+        if host == "card.wb.ru" and route == "/cards/v2/detail":
+            return self.json(self.get_card(query))
+        if host == "feedbacks2.wb.ru" and route.startswith("/feedbacks/v1/"):
+            return self.json(self.get_feedbacks(route.rsplit("/", 1)[-1]))
+        if host.endswith(".wbbasket.ru") and host.startswith("feedback"):
+            return self.get_photo(method, host, route)
+        if host == "www.wildberries.ru" and route.endswith("/detail.aspx"):
+            return self.get_detail_page(route.split("/")[2])
+        return 404, {}, b""
+
+    def get_recorded(self, host, route, query) -> bytes | None:
+        if not self.fixtures_dir:
+            return None
+        path = os.path.join(self.fixtures_dir, host, route.lstrip("/"))
+        for candidate in (f"{path}@{query}" if query else None, path):
+            if candidate and os.path.isfile(candidate):
+                with open(candidate, "rb") as file:
+                    return file.read()
+        return None
+
+    @staticmethod
+    def json(data) -> tuple[int, dict, bytes]:
+        if data is None:
+            return 404, {}, b""
+        body = json.dumps(data, ensure_ascii=False).encode()
+        return 200, {"Content-Type": "application/json; charset=utf-8"}, body
+
+    def get_menu(self, headers):
+        if headers.get("If-None-Match") == CATEGORY_MENU_ETAG:
+            return 304, {"ETag": CATEGORY_MENU_ETAG}, b""
+        status, response_headers, body = self.json(self.menu)
+        return status, {**response_headers, "ETag": CATEGORY_MENU_ETAG}, body
+
+    def get_product_id(self, position, index) -> int:
+        return (position + 1) * PRODUCT_ID_BASE + index
+
+    def get_root(self, product_id) -> int:
+        return product_id - product_id % self.variants_per_root
+
+    def get_product(self, product_id) -> dict:
+        return {
+            "id": product_id,
+            "root": self.get_root(product_id),
+            "name": f"Product {product_id}",
+            "subjectId": product_id // PRODUCT_ID_BASE,
+        }
+
+    def get_catalog(self, query):
+        position = self.category_positions.get(get_int(query.get("cat")))
+        page = get_int(query.get("page")) or 1
+        if position is None or page > self.catalog_pages:
+            return {"data": {"products": []}}
+        start = (page - 1) * self.products_per_page
+        return {
+            "data": {
+                "products": [
+                    self.get_product(self.get_product_id(position, index))
+                    for index in range(start, start + self.products_per_page)
+                ]
+            }
+        }
+
+    def get_card(self, query):
+        product_id = get_int(query.get("nm"))
+        if not 0 < product_id // PRODUCT_ID_BASE <= len(self.categories):
+            return {"data": {"products": []}}
+        return {"data": {"products": [self.get_product(product_id)]}}
+
+    def get_basket(self, volume) -> int:
+        return 1 + volume * self.baskets // 10000
+
+    def get_feedbacks(self, root):
+        root = get_int(root)
+        feedbacks = []
+        for index in range(self.feedbacks_per_root):
+            volume = (root // self.variants_per_root + index) % 9000 + 1000
+            feedbacks.append(
+                {
+                    "id": f"fb{root}x{index}",
+                    "nmId": root,
+                    "text": f"Feedback {index} about {root}",
+                    "productValuation": 5 if index % 5 else 4,
+                    "createdDate": (
+                        self.created_at - timedelta(hours=index)
+                    ).isoformat(),
+                    "wbUserDetails": {"name": f"User {index}"},
+                    "photo": [
+                        int(f"{volume}{root % 100:02d}{index:03d}{photo}")
+                        for photo in range(self.photos_per_feedback)
+                    ],
+                }
+            )
+        return {"feedbacks": feedbacks}
+
+    def get_photo(self, method, host, route):
+        parts = route.strip("/").split("/")
+        basket_id = host.split(".", 1)[0].removeprefix("feedback")
+        if (
+            len(parts) < 3
+            or not parts[0].startswith("vol")
+            or get_int(basket_id) != self.get_basket(get_int(parts[0][3:]))
+        ):
+            return 404, {}, b""
+        body = b"" if method == "HEAD" else b"\0"
+        return 200, {"Content-Type": "image/webp"}, body
+
+    def get_detail_page(self, product_id):
+        product_id = get_int(product_id)
+        position = product_id // PRODUCT_ID_BASE - 1
+        if not 0 <= position < len(self.categories):
+            return 404, {}, b""
+        category = self.categories[position]
+        body = (
+            '<html><body><div class="product-page"><ul class="breadcrumbs__list">'
+            '<li class="breadcrumbs__item"><a class="breadcrumbs__link" href="/">'
+            'Главная</a></li><li class="breadcrumbs__item">'
+            f'<a class="breadcrumbs__link" href="{category.url}">{category.name}</a>'
+            f"</li></ul><h1>Product {product_id}</h1></div>"
+            f"{'<p>Описание</p>' * 2000}</body></html>"
+        )
+        return 200, {"Content-Type": "text/html; charset=utf-8"}, body.encode()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "responses": dict(self.responses),
+            }
+
+
+class FakeWildberriesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # The client stopped reading, e.g. once it found the breadcrumb
+            pass
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_HEAD(self):
+        self.respond("HEAD")
+
+    def respond(self, method):
+        fake = self.server.fake
+        status, headers, body = fake.handle(method, self.path, self.headers)
+        with fake._lock:
+            fake.responses[status] += 1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWildberriesServer:
+    """Runs ``FakeWildberries`` on a local port in a background thread.
+
+    Usable as a context manager; ``url`` is the value for ``WB_UPSTREAM_URL``.
+    """
+
+    def __init__(self, fake=None, host="127.0.0.1", port=0):
+        self.fake = fake or FakeWildberries()
+        self.server = ThreadingHTTPServer((host, port), FakeWildberriesHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self.fake
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,60 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+
+class AsyncFetcher:
+    """Fetches many URLs at once with bounded overall and per-host concurrency.
+
+    Requests are issued by the blocking ``fetch`` callable (``send_request`` of
+    the client by default) on worker threads, so everything the client does
+    around a request keeps working unchanged. Results are handed back to the
+    synchronous caller, which keeps all database writes on the calling thread.
+    """
+
+    def __init__(self, fetch, concurrency=None, per_host_concurrency=None):
+        self.fetch = fetch
+        self.concurrency = concurrency or settings.WB_FETCH_CONCURRENCY
+        self.per_host_concurrency = (
+            per_host_concurrency or settings.WB_FETCH_PER_HOST_CONCURRENCY
+        )
+
+    async def _fetch_one(self, url, fetch, executor, semaphore, host_semaphores):
+        host = urlparse(url).netloc
+        async with semaphore, host_semaphores[host]:
+            loop = asyncio.get_running_loop()
+            return url, await loop.run_in_executor(executor, fetch, url)
+
+    async def _fetch_all(self, urls, fetch, executor):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_semaphores = defaultdict(
+            lambda: asyncio.Semaphore(self.per_host_concurrency)
+        )
+        tasks = [
+            self._fetch_one(url, fetch, executor, semaphore, host_semaphores)
+            for url in urls
+        ]
+        return dict(await asyncio.gather(*tasks))
+
+    def fetch_many(self, urls, fetch=None) -> dict:
+        """Returns a mapping of every unique URL to its fetched result."""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        # The default executor of the loop would cap the concurrency at a few
+        # threads per CPU
+        with ThreadPoolExecutor(
+            max_workers=min(self.concurrency, len(urls))
+        ) as executor:
+            return asyncio.run(self._fetch_all(urls, fetch or self.fetch, executor))
+
+    def iter_batches(self, urls, batch_size=None, fetch=None):
+        """Yields fetched results in batches to keep memory use bounded."""
+        batch_size = batch_size or settings.WB_FETCH_BATCH_SIZE
+        urls = list(dict.fromkeys(urls))
+        for start in range(0, len(urls), batch_size):
+            end = start + batch_size
+            yield self.fetch_many(urls[start:end], fetch=fetch)
@@ -0,0 +1,556 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import ijson
+from core.metrics import metrics
+from dateutil.parser import ParserError, parse
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone as django_timezone
+from scraper.models import (
+    Comment,
+    CommentFiles,
+    CommentStatuses,
+    FeedbackCursor,
+    FileTypeChoices,
+    Product,
+)
+from scraper.utils.baskets import UNRESOLVED
+from scraper.utils.categories import add_category_products
+from scraper.utils.schedule import update_change_rate
+
+FEEDBACK_MAX_AGE = timedelta(weeks=2)
+FEEDBACK_RATING = 5
+# Fields of a feedback read by the ingest; the rest are dropped while decoding
+FEEDBACK_FIELDS = (
+    "id",
+    "createdDate",
+    "productValuation",
+    "text",
+    "wbUserDetails",
+    "photo",
+    "video",
+)
+
+# Sets the image of every product in an id range that has none to the first
+# image of its earliest accepted comment: the comment's own file when it is an
+# image, otherwise the comment's first image file.
+BACKFILL_IMAGE_LINKS_SQL = """
+UPDATE {product} SET image_link = ranked.image_link
+FROM (
+    SELECT
+        candidates.product_id,
+        candidates.image_link,
+        ROW_NUMBER() OVER (
+            PARTITION BY candidates.product_id ORDER BY candidates.comment_id
+        ) AS position
+    FROM (
+        SELECT
+            comment.product_id,
+            comment.id AS comment_id,
+            CASE
+                WHEN comment.file <> '' AND comment.file_type = %(image)s
+                THEN %(media_url)s || comment.file
+                ELSE (
+                    SELECT file.file_link
+                    FROM {files} AS file
+                    WHERE file.comment_id = comment.id AND file.file_type = %(image)s
+                    ORDER BY file.id
+                    LIMIT 1
+                )
+            END AS image_link
+        FROM {comment} AS comment
+        JOIN {product} AS product ON product.id = comment.product_id
+        WHERE product.id BETWEEN %(start)s AND %(end)s
+            AND product.image_link IS NULL
+            AND comment.status = %(status)s
+            AND comment.content IS NOT NULL
+    ) AS candidates
+    WHERE candidates.image_link IS NOT NULL
+) AS ranked
+WHERE ranked.position = 1
+    AND {product}.id = ranked.product_id
+    AND {product}.image_link IS NULL
+"""
+
+
+def empty_report(*keys) -> dict:
+    return {key: 0 for key in keys or ("inserted", "updated", "skipped")}
+
+
+def merge_reports(report: dict, other: dict) -> dict:
+    for key, value in other.items():
+        report[key] = report.get(key, 0) + value
+    return report
+
+
+def save_products_skipping_conflicts(category, products, known_source_ids) -> int:
+    """Saves a page of products, skipping conflicting rows, one kind at a time.
+
+    Known products get their ``root`` refreshed, new ones are inserted with
+    conflicting rows ignored, and the category counter is bumped only by the
+    rows that were actually inserted.
+    """
+    roots = {product.source_id: product.root for product in products}
+    new_products = [
+        product for product in products if product.source_id not in known_source_ids
+    ]
+    present = Product.objects.filter(
+        source_id__in=[product.source_id for product in new_products]
+    )
+    with transaction.atomic():
+        known_products = list(
+            Product.objects.filter(source_id__in=known_source_ids).only(
+                "pk", "source_id", "root"
+            )
+        )
+        for product in known_products:
+            product.root = roots[product.source_id]
+        Product.objects.bulk_update(known_products, ["root"], batch_size=500)
+
+        before = present.count()
+        Product.objects.bulk_create(new_products, ignore_conflicts=True)
+        inserted = present.count() - before
+        add_category_products(category.pk, inserted)
+    return inserted
+
+
+@metrics.timed("scraper_db_write_seconds", operation="upsert_products")
+def upsert_products(category, products, existing_source_ids=None) -> dict:
+    """Upserts a catalog page of products in a single statement.
+
+    Products are keyed on ``source_id``; known ones get their ``root``
+    refreshed. Rows without an id or name, duplicates within the page and
+    titles that already belong to another product are skipped.
+    """
+    report = empty_report()
+    rows = {}
+    titles = set()
+    for product in products:
+        source_id = product.get("id")
+        title = product.get("name")
+        if not source_id or not title or source_id in rows or title in titles:
+            report["skipped"] += 1
+            continue
+        titles.add(title)
+        rows[source_id] = Product(
+            title=title,
+            source_id=source_id,
+            category=category,
+            root=int(product["root"]) if product.get("root") else None,
+        )
+    if not rows:
+        return report
+
+    known_source_ids = set()
+    taken_titles = set()
+    for source_id, title in Product.objects.filter(
+        Q(source_id__in=rows) | Q(title__in=titles)
+    ).values_list("source_id", "title"):
+        if source_id in rows:
+            known_source_ids.add(source_id)
+        elif title in titles:
+            taken_titles.add(title)
+
+    objects = []
+    for source_id, product in rows.items():
+        if product.title in taken_titles:
+            report["skipped"] += 1
+            continue
+        objects.append(product)
+        if source_id in known_source_ids:
+            report["updated"] += 1
+        else:
+            report["inserted"] += 1
+
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=["source_id"],
+                update_fields=["root"],
+            )
+            add_category_products(category.pk, report["inserted"])
+    except IntegrityError:
+        # A concurrent writer took one of the titles; keep the rest of the page
+        inserted = save_products_skipping_conflicts(category, objects, known_source_ids)
+        report["skipped"] += report["inserted"] - inserted
+        report["inserted"] = inserted
+
+    if existing_source_ids is not None:
+        existing_source_ids.update(rows)
+    return report
+
+
+@metrics.timed("scraper_db_write_seconds", operation="backfill_product_image_links")
+def backfill_product_image_links(batch_size=None) -> int:
+    """Fills missing product images from accepted comments, one id range at a time.
+
+    Each batch is a single ``UPDATE`` that ranks the image candidates of all
+    products in the range with a window function, so the cost does not grow
+    with a query per product. Returns the number of updated products.
+    """
+    batch_size = batch_size or settings.WB_IMAGE_BACKFILL_BATCH_SIZE
+    bounds = Product.objects.filter(image_link__isnull=True).aggregate(
+        start=Min("id"), end=Max("id")
+    )
+    if bounds["start"] is None:
+        return 0
+
+    sql = BACKFILL_IMAGE_LINKS_SQL.format(
+        product=connection.ops.quote_name(Product._meta.db_table),
+        comment=connection.ops.quote_name(Comment._meta.db_table),
+        files=connection.ops.quote_name(CommentFiles._meta.db_table),
+    )
+    params = {
+        "image": FileTypeChoices.IMAGE,
+        "media_url": default_storage.url(""),
+        "status": CommentStatuses.ACCEPTED,
+    }
+    updated = 0
+    for start in range(bounds["start"], bounds["end"] + 1, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql, {**params, "start": start, "end": start + batch_size - 1}
+            )
+            updated += cursor.rowcount
+    return updated
+
+
+def get_published_date(feedback) -> datetime | None:
+    created_date = feedback.get("createdDate")
+    if not created_date:
+        return None
+    try:
+        # Wildberries sends ISO 8601 dates, dateutil is only a slow fallback
+        return datetime.fromisoformat(created_date)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return parse(created_date, yearfirst=True)
+    except (ParserError, TypeError):
+        return None
+
+
+def is_wanted_feedback(feedback, since) -> bool:
+    """Returns whether a feedback is a 5-star one with text published since ``since``."""
+    if feedback.get("productValuation", 0) != FEEDBACK_RATING or not feedback.get(
+        "text"
+    ):
+        return False
+    published_date = get_published_date(feedback)
+    return bool(published_date and published_date >= since)
+
+
+def iter_wanted_feedbacks(stream):
+    """Decodes a feedbacks response one feedback at a time.
+
+    Only the feedbacks the ingest would keep are yielded, trimmed to
+    ``FEEDBACK_FIELDS``, so the whole payload is never held in memory.
+    """
+    since = datetime.now(timezone.utc) - FEEDBACK_MAX_AGE
+    for feedback in ijson.items(stream, "feedbacks.item", use_float=True):
+        if isinstance(feedback, dict) and is_wanted_feedback(feedback, since):
+            yield {field: feedback.get(field) for field in FEEDBACK_FIELDS}
+
+
+def get_feedback_source_id(feedback) -> int | None:
+    """Returns the ``Comment.source_id`` of a feedback.
+
+    Wildberries feedback ids are alphanumeric, so they are stored as a 63-bit
+    hash that fits the big integer column.
+    """
+    feedback_id = feedback.get("id")
+    if not feedback_id:
+        return None
+    digest = hashlib.blake2b(str(feedback_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 1
+
+
+def get_video_link(video) -> str | None:
+    if not isinstance(video, dict) or "/" not in video.get("id", ""):
+        return None
+    basket_id, uuid = video["id"].split("/", 1)
+    return "https://videofeedback0{}.wbbasket.ru/{}/index.m3u8".format(basket_id, uuid)
+
+
+def insert_comments(comments) -> int:
+    """Inserts comments in bulk and returns how many were saved.
+
+    When a concurrent run already saved some of them, the batch is retried
+    one row at a time; comments that still conflict are left without a
+    primary key.
+    """
+    try:
+        with transaction.atomic():
+            Comment.objects.bulk_create(comments)
+        return len(comments)
+    except IntegrityError:
+        pass
+
+    inserted = 0
+    for comment in comments:
+        try:
+            with transaction.atomic():
+                Comment.objects.bulk_create([comment])
+            inserted += 1
+        except IntegrityError:
+            comment.pk = None
+    return inserted
+
+
+def adopt_source_ids(comments):
+    """Stores the feedback ids matched to comments scraped without one.
+
+    Ids a concurrent run already stored elsewhere are left out.
+    """
+    try:
+        with transaction.atomic():
+            Comment.objects.bulk_update(comments, ["source_id"], batch_size=500)
+    except IntegrityError:
+        for comment in comments:
+            try:
+                with transaction.atomic():
+                    Comment.objects.filter(pk=comment.pk).update(
+                        source_id=comment.source_id
+                    )
+            except IntegrityError:
+                pass
+
+
+def ingest_feedbacks(client, feedbacks_by_product, unresolved=None) -> dict:
+    """Saves new recent 5-star feedbacks of many products in bulk.
+
+    Feedbacks are filtered in memory, deduplicated against existing comments
+    by their feedback id with a single indexed query, and their photos are
+    resolved concurrently. Comments saved before feedback ids were stored are
+    matched by content hash instead. Comments without any photo or video are
+    not saved; the ids of feedbacks whose photos could not be checked are
+    added to ``unresolved``, so they can be retried.
+    """
+    report = empty_report(
+        "inserted", "duplicates", "filtered", "without_media", "unresolved"
+    )
+    since = datetime.now(timezone.utc) - FEEDBACK_MAX_AGE
+
+    candidates = []
+    seen = set()
+    for product_id, feedbacks in feedbacks_by_product.items():
+        for feedback in feedbacks:
+            if not is_wanted_feedback(feedback, since):
+                report["filtered"] += 1
+                continue
+            content_hash = Comment.get_content_hash(feedback["text"])
+            source_id = get_feedback_source_id(feedback)
+            # Different feedbacks often share a short text, so only feedbacks
+            # without an id are told apart by their content
+            key = source_id or (product_id, content_hash)
+            if key in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(key)
+            candidates.append(
+                (
+                    product_id,
+                    content_hash,
+                    feedback,
+                    source_id,
+                    get_published_date(feedback),
+                )
+            )
+    if not candidates:
+        return report
+
+    # Comments scraped before feedback ids were stored only match by content,
+    # one comment per feedback, and take over the id of the matched feedback
+    existing_source_ids = set()
+    legacy = {}
+    for pk, source_id, product_id, content_hash in Comment.objects.filter(
+        Q(source_id__in={candidate[3] for candidate in candidates if candidate[3]})
+        | Q(
+            source_id__isnull=True,
+            product_id__in={candidate[0] for candidate in candidates},
+            content_hash__in={candidate[1] for candidate in candidates},
+        )
+    ).values_list("pk", "source_id", "product_id", "content_hash"):
+        if source_id:
+            existing_source_ids.add(source_id)
+        else:
+            legacy.setdefault((product_id, content_hash), []).append(pk)
+
+    new_feedbacks = []
+    adopted = []
+    for candidate in candidates:
+        product_id, content_hash, _, source_id, _ = candidate
+        if source_id in existing_source_ids:
+            report["duplicates"] += 1
+        elif legacy.get((product_id, content_hash)):
+            report["duplicates"] += 1
+            pk = legacy[product_id, content_hash].pop()
+            if source_id:
+                adopted.append(Comment(pk=pk, source_id=source_id))
+        else:
+            new_feedbacks.append(candidate)
+
+    photo_links = client.fetcher.fetch_many(
+        (
+            str(photo_id)
+            for _, _, feedback, _, _ in new_feedbacks
+            for photo_id in feedback.get("photo") or []
+        ),
+        fetch=client.baskets.resolve,
+    )
+
+    comments = []
+    files = []
+    for product_id, content_hash, feedback, source_id, published_date in new_feedbacks:
+        photos = [
+            photo_links.get(str(photo_id)) for photo_id in feedback.get("photo") or []
+        ]
+        image_links = [link for link in photos if link and link is not UNRESOLVED]
+        video_link = None if image_links else get_video_link(feedback.get("video"))
+        if not image_links and not video_link:
+            if UNRESOLVED in photos:
+                report["unresolved"] += 1
+                if unresolved is not None:
+                    unresolved.add(feedback.get("id"))
+            else:
+                report["without_media"] += 1
+            continue
+
+        comment = Comment(
+            product_id=product_id,
+            source_id=source_id,
+            content=feedback["text"],
+            content_hash=content_hash,
+            rating=FEEDBACK_RATING,
+            status=CommentStatuses.ACCEPTED,
+            wb_user=(feedback.get("wbUserDetails") or {}).get("name", ""),
+            source_date=published_date,
+        )
+        comments.append(comment)
+        files.extend(
+            CommentFiles(
+                comment=comment, file_link=link, file_type=FileTypeChoices.IMAGE
+            )
+            for link in image_links
+        )
+        if video_link:
+            files.append(
+                CommentFiles(
+                    comment=comment,
+                    file_link=video_link,
+                    file_type=FileTypeChoices.VIDEO,
+                )
+            )
+
+    with (
+        metrics.timer("scraper_db_write_seconds", operation="ingest_feedbacks"),
+        transaction.atomic(),
+    ):
+        adopt_source_ids(adopted)
+        inserted = insert_comments(comments)
+        # Files of comments another run saved first stay with that run
+        files = [file for file in files if file.comment.pk]
+        CommentFiles.objects.bulk_create(files, ignore_conflicts=True)
+
+        product_images = {}
+        for file in files:
+            if file.file_type == FileTypeChoices.IMAGE:
+                product_images.setdefault(file.comment.product_id, file.file_link)
+        products = list(
+            Product.objects.filter(id__in=product_images, image_link__isnull=True)
+        )
+        for product in products:
+            product.image_link = product_images[product.id]
+        Product.objects.bulk_update(products, ["image_link"])
+
+    report["inserted"] += inserted
+    report["duplicates"] += len(comments) - inserted
+    return report
+
+
+def get_feedback_cursors(roots) -> dict:
+    return {
+        cursor.root: cursor for cursor in FeedbackCursor.objects.filter(root__in=roots)
+    }
+
+
+def select_new_feedbacks(feedbacks, cursor) -> list:
+    """Drops feedbacks at or below the high-water mark of the root's cursor."""
+    if not cursor or not cursor.last_feedback_date:
+        return feedbacks
+    new_feedbacks = []
+    for feedback in feedbacks:
+        published_date = get_published_date(feedback)
+        if not published_date or published_date < cursor.last_feedback_date:
+            continue
+        if (
+            published_date == cursor.last_feedback_date
+            and feedback.get("id") == cursor.last_feedback_id
+        ):
+            continue
+        new_feedbacks.append(feedback)
+    return new_feedbacks
+
+
+@metrics.timed("scraper_db_write_seconds", operation="advance_feedback_cursors")
+def advance_feedback_cursors(feedbacks_by_root, cursors, unresolved=None):
+    """Moves the cursors of the checked roots to their latest feedback.
+
+    A cursor stays below the oldest feedback of ``unresolved`` ids, so those
+    are read again on the next check.
+    """
+    now = django_timezone.now()
+    unresolved = unresolved or set()
+    objects = []
+    for root, feedbacks in feedbacks_by_root.items():
+        cursor = cursors.get(root) or FeedbackCursor(root=root)
+        cursor.change_rate = update_change_rate(
+            cursor.change_rate,
+            len(select_new_feedbacks(feedbacks, cursor)),
+            cursor.checked_at,
+            now,
+        )
+        dated = [
+            (published_date, feedback.get("id"))
+            for feedback in feedbacks
+            if (published_date := get_published_date(feedback))
+        ]
+        held_at = min(
+            (date for date, feedback_id in dated if feedback_id in unresolved),
+            default=None,
+        )
+        latest = max(
+            (
+                (date, feedback_id)
+                for date, feedback_id in dated
+                if held_at is None or date < held_at
+            ),
+            default=None,
+            key=lambda item: item[0],
+        )
+        if latest and (
+            not cursor.last_feedback_date or latest[0] > cursor.last_feedback_date
+        ):
+            cursor.last_feedback_date, cursor.last_feedback_id = latest
+            cursor.changed_at = now
+        cursor.checked_at = now
+        objects.append(cursor)
+
+    FeedbackCursor.objects.bulk_create(
+        objects,
+        update_conflicts=True,
+        unique_fields=["root"],
+        update_fields=[
+            "last_feedback_date",
+            "last_feedback_id",
+            "checked_at",
+            "changed_at",
+            "change_rate",
+            "updated_at",
+        ],
+    )
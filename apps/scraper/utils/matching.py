@@ -0,0 +1,63 @@
+from collections import deque
+
+
+def normalize_title(title: str) -> str:
+    return " ".join((title or "").lower().split())
+
+
+class TitleMatcher:
+    """Finds which of many product titles occur in a text in a single pass.
+
+    The titles are compiled into an Aho-Corasick automaton, so matching a
+    catalog item name costs time proportional to the name length no matter
+    how many titles are pending.
+    """
+
+    def __init__(self, titles: dict):
+        self.transitions = [{}]
+        self.fallbacks = [0]
+        self.outputs = [[]]
+        for key, title in titles.items():
+            title = normalize_title(title)
+            if title:
+                self._add(key, title)
+        self._build_fallbacks()
+
+    def _add(self, key, title):
+        node = 0
+        for char in title:
+            next_node = self.transitions[node].get(char)
+            if next_node is None:
+                next_node = len(self.transitions)
+                self.transitions.append({})
+                self.fallbacks.append(0)
+                self.outputs.append([])
+                self.transitions[node][char] = next_node
+            node = next_node
+        self.outputs[node].append(key)
+
+    def _build_fallbacks(self):
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.transitions[node].items():
+                queue.append(next_node)
+                fallback = self.fallbacks[node]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fallbacks[fallback]
+                self.fallbacks[next_node] = self.transitions[fallback].get(char, 0)
+                self.outputs[next_node] = (
+                    self.outputs[next_node] + self.outputs[self.fallbacks[next_node]]
+                )
+
+    def find(self, text: str) -> list:
+        """Returns the keys of all titles contained in the text."""
+        found = {}
+        node = 0
+        for char in normalize_title(text):
+            while node and char not in self.transitions[node]:
+                node = self.fallbacks[node]
+            node = self.transitions[node].get(char, 0)
+            for key in self.outputs[node]:
+                found[key] = None
+        return list(found)
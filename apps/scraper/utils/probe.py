@@ -0,0 +1,74 @@
+import hashlib
+
+import requests
+from core.metrics import metrics
+from django.conf import settings
+from django.core.cache import cache
+
+MEDIA_PROBE_CACHE_PREFIX = "wb:media_probe"
+
+
+class MediaProbe:
+    """Checks whether a media file exists from the response status and headers.
+
+    A ``HEAD`` request is sent (or a 0-byte range ``GET`` when the host does
+    not allow ``HEAD``), so no body is downloaded or parsed. Definite answers
+    are cached in the shared cache with separate TTLs for hits and misses;
+    transient failures are not cached.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def get_cache_key(url: str) -> str:
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        return f"{MEDIA_PROBE_CACHE_PREFIX}:{digest}"
+
+    def exists(self, url: str) -> bool:
+        return bool(self.check(url))
+
+    def check(self, url: str) -> bool | None:
+        """Returns whether the media exists, or ``None`` if it is unknown."""
+        key = self.get_cache_key(url)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        with metrics.timer("wb_media_probe_seconds"):
+            result = self.probe(url)
+        metrics.inc(
+            "wb_media_probes_total",
+            result={True: "found", False: "missing", None: "unknown"}[result],
+        )
+        if result is None:
+            return None
+        cache.set(
+            key,
+            result,
+            timeout=(
+                settings.WB_MEDIA_PROBE_HIT_TTL
+                if result
+                else settings.WB_MEDIA_PROBE_MISS_TTL
+            ),
+        )
+        return result
+
+    def probe(self, url: str) -> bool | None:
+        """Returns whether the media exists, or ``None`` if it is unknown."""
+        try:
+            response = self.client.head(url, allow_redirects=True)
+            if response.status_code in (405, 501):
+                response = self.client.get(
+                    url, headers={"Range": "bytes=0-0"}, stream=True
+                )
+                response.close()
+        except requests.exceptions.RequestException:
+            return None
+
+        if response.status_code in (404, 410):
+            return False
+        if response.status_code not in (200, 206):
+            return None
+        content_type = response.headers.get("Content-Type", "")
+        return not content_type.startswith("text/html")
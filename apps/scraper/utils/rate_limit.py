@@ -0,0 +1,155 @@
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+RATE_LIMIT_KEY_PREFIX = "rate_limit"
+
+# Takes a token from the host bucket and returns how many milliseconds the
+# caller has to wait before retrying (0 when a token was taken) together with
+# the current adaptive rate factor multiplied by 1000.
+ACQUIRE_SCRIPT = """
+local now_time = redis.call("TIME")
+local now = tonumber(now_time[1]) * 1000 + math.floor(tonumber(now_time[2]) / 1000)
+local blocked_until = tonumber(redis.call("GET", KEYS[2]) or "0")
+local factor = tonumber(redis.call("GET", KEYS[3]) or "1")
+if blocked_until > now then
+    return {blocked_until - now, math.floor(factor * 1000)}
+end
+local rate = tonumber(ARGV[1]) * factor
+local burst = tonumber(ARGV[2])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated_at) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {wait, math.floor(factor * 1000)}
+"""
+
+# Multiplies the adaptive rate factor of a host, keeping it within bounds.
+ADJUST_SCRIPT = """
+local factor = tonumber(redis.call("GET", KEYS[1]) or "1")
+factor = factor * tonumber(ARGV[1]) + tonumber(ARGV[2])
+factor = math.max(tonumber(ARGV[3]), math.min(1, factor))
+redis.call("SET", KEYS[1], factor, "EX", 3600)
+return tostring(factor)
+"""
+
+
+class RateLimitTimeout(requests.exceptions.RequestException):
+    """Raised when no request slot was granted within the maximum wait."""
+
+
+class RateLimiter:
+    """Token-bucket limiter of outgoing requests, shared by all workers via Redis.
+
+    Every host has its own bucket refilled at the configured rate. Throttling
+    responses block the host for their ``Retry-After`` period, and throttling
+    or server errors halve the host rate, which then recovers additively on
+    successful responses.
+    """
+
+    def __init__(self):
+        self._factors = {}
+        self._acquire_script = None
+        self._adjust_script = None
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    @staticmethod
+    def get_rate(host: str) -> float:
+        for suffix, rate in settings.WB_RATE_LIMITS.items():
+            if host == suffix or host.endswith(f".{suffix}"):
+                return rate
+        return settings.WB_RATE_LIMIT_DEFAULT
+
+    @staticmethod
+    def get_keys(host: str) -> list[str]:
+        prefix = f"{settings.WB_REDIS_KEY_PREFIX}:{RATE_LIMIT_KEY_PREFIX}:{host}"
+        return [f"{prefix}:bucket", f"{prefix}:blocked_until", f"{prefix}:factor"]
+
+    def acquire(self, url: str):
+        """Blocks until a request to the URL's host is allowed."""
+        host = urlparse(url).netloc
+        rate = self.get_rate(host)
+        burst = max(rate * settings.WB_RATE_LIMIT_BURST_SECONDS, 1)
+        deadline = time.monotonic() + settings.WB_RATE_LIMIT_MAX_WAIT
+        while True:
+            try:
+                if self._acquire_script is None:
+                    self._acquire_script = self.redis.register_script(ACQUIRE_SCRIPT)
+                wait, factor = self._acquire_script(
+                    keys=self.get_keys(host), args=[rate, burst]
+                )
+            except RedisError:
+                # Scraping goes on unthrottled rather than stopping with Redis
+                return
+            self._factors[host] = factor / 1000
+            if not wait:
+                return
+            if time.monotonic() + wait / 1000 > deadline:
+                raise RateLimitTimeout(f"No request slot for {host}")
+            time.sleep(wait / 1000)
+
+    def feedback(self, url: str, response: requests.Response | None):
+        """Adapts the host rate to the outcome of a request."""
+        host = urlparse(url).netloc
+        status_code = response.status_code if response is not None else None
+        try:
+            if status_code in (429, 503):
+                retry_after = self.get_retry_after(response)
+                if retry_after:
+                    self.redis.set(
+                        self.get_keys(host)[1],
+                        int((time.time() + retry_after) * 1000),
+                        px=int(retry_after * 1000),
+                    )
+            if status_code is None or status_code == 429 or status_code >= 500:
+                self.adjust(host, multiplier=0.5)
+            elif self._factors.get(host, 1) < 1:
+                self.adjust(host, increment=settings.WB_RATE_LIMIT_RECOVERY_STEP)
+        except RedisError:
+            pass
+
+    def adjust(self, host: str, multiplier: float = 1, increment: float = 0):
+        if self._adjust_script is None:
+            self._adjust_script = self.redis.register_script(ADJUST_SCRIPT)
+        factor = self._adjust_script(
+            keys=[self.get_keys(host)[2]],
+            args=[multiplier, increment, settings.WB_RATE_LIMIT_MIN_FACTOR],
+        )
+        self._factors[host] = float(factor)
+
+    @staticmethod
+    def get_retry_after(response: requests.Response) -> float | None:
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def stats(self) -> dict:
+        """Returns the last seen adaptive rate of every host."""
+        return {
+            host: {"rate": self.get_rate(host) * factor, "factor": factor}
+            for host, factor in self._factors.items()
+        }
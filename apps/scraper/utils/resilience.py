@@ -0,0 +1,186 @@
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from scraper.utils.rate_limit import RateLimitTimeout
+
+CATALOG_SHARD_PATTERN = re.compile(r"^/catalog/([^/]+)/")
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request to a host whose breaker is open."""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises ``CircuitOpenError`` unless a request may be sent now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    raise CircuitOpenError("Circuit breaker is open")
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                # Only one trial request decides whether the host is back
+                if self._trial_running:
+                    raise CircuitOpenError("Circuit breaker is half-open")
+                self._trial_running = True
+
+    def release(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+
+class RetryBudget:
+    """Allows retries only up to a ratio of the requests sent recently."""
+
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Resilience:
+    """Retries failed requests with jittered exponential backoff.
+
+    Each host (and each catalog shard) has its own circuit breaker, so a host
+    that keeps failing is skipped immediately until its reset timeout passes.
+    Retries are limited by a client-wide retry budget.
+    """
+
+    def __init__(self):
+        self.max_retries = settings.WB_RETRY_MAX_ATTEMPTS
+        self.backoff_base = settings.WB_RETRY_BACKOFF_BASE
+        self.backoff_max = settings.WB_RETRY_BACKOFF_MAX
+        self.budget = RetryBudget(
+            settings.WB_RETRY_BUDGET_RATIO, settings.WB_RETRY_BUDGET_MAX_TOKENS
+        )
+        self.retries = 0
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_breaker_key(url: str) -> str:
+        parsed_url = urlparse(url)
+        shard = CATALOG_SHARD_PATTERN.match(parsed_url.path)
+        if parsed_url.netloc == "catalog.wb.ru" and shard:
+            return f"{parsed_url.netloc}/{shard.group(1)}"
+        return parsed_url.netloc
+
+    def get_breaker(self, url: str) -> CircuitBreaker:
+        key = self.get_breaker_key(url)
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(
+                    settings.WB_BREAKER_FAILURE_THRESHOLD,
+                    settings.WB_BREAKER_RESET_SECONDS,
+                )
+            return self._breakers[key]
+
+    @staticmethod
+    def is_failure(response: requests.Response) -> bool:
+        return response.status_code == 429 or response.status_code >= 500
+
+    def get_backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def call(self, url: str, send) -> requests.Response:
+        """Sends a request through ``send`` with retries and a circuit breaker."""
+        breaker = self.get_breaker(url)
+        breaker.before_call()
+        self.budget.deposit()
+
+        attempt = 0
+        while True:
+            error = response = None
+            try:
+                response = send()
+            except RateLimitTimeout:
+                # Nothing was sent, so the host health is unknown
+                breaker.release()
+                raise
+            except requests.exceptions.RequestException as exc:
+                error = exc
+            if response is not None and not self.is_failure(response):
+                breaker.record_success()
+                return response
+
+            breaker.record_failure()
+            if (
+                attempt >= self.max_retries
+                or breaker.is_open
+                or not self.budget.withdraw()
+            ):
+                if error is not None:
+                    raise error
+                return response
+
+            if response is not None:
+                # Give the connection of a streamed response back to the pool
+                response.close()
+            self.retries += 1
+            time.sleep(self.get_backoff(attempt))
+            attempt += 1
+            breaker.before_call()
+
+    def stats(self) -> dict:
+        with self._lock:
+            breakers = {
+                key: {
+                    "state": breaker.state,
+                    "failures": breaker.failures,
+                    "trips": breaker.trips,
+                }
+                for key, breaker in self._breakers.items()
+            }
+        return {"retries": self.retries, "breakers": breakers}
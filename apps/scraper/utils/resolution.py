@@ -0,0 +1,42 @@
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+RESOLVE_PRODUCT_KEY_PREFIX = "wb:resolve_product"
+
+
+class ProductLookupError(requests.exceptions.RequestException):
+    """Raised when it is unknown whether an article exists on Wildberries."""
+
+
+def get_resolve_product_key(source_id) -> str:
+    return f"{RESOLVE_PRODUCT_KEY_PREFIX}:{source_id}"
+
+
+def enqueue_product_resolution(source_id) -> bool:
+    """Queues the product lookup of an article unless one is already pending."""
+    if not cache.add(
+        get_resolve_product_key(source_id),
+        True,
+        timeout=settings.RESOLVE_COMMENT_PRODUCT_LOCK_SECONDS,
+    ):
+        return False
+
+    from config.celery import resolve_comment_product
+
+    resolve_comment_product.delay(source_id)
+    return True
+
+
+def hold_product_resolution(source_id, seconds):
+    """Keeps an article marked as pending while its lookup waits for a retry."""
+    cache.set(
+        get_resolve_product_key(source_id),
+        True,
+        timeout=seconds + settings.RESOLVE_COMMENT_PRODUCT_LOCK_SECONDS,
+    )
+
+
+def release_product_resolution(source_id):
+    """Lets the next comment of an article queue a new lookup."""
+    cache.delete(get_resolve_product_key(source_id))
@@ -0,0 +1,47 @@
+from django.db.models import DurationField, ExpressionWrapper, F, Value
+from django.db.models.functions import Least
+from django.utils import timezone
+
+# Weight of the latest observation in the smoothed change rate
+CHANGE_RATE_SMOOTHING = 0.3
+# Categories with fewer products are ranked as up to twice as stale
+UNDERFILLED_PRODUCT_COUNT = 100
+
+
+def update_change_rate(change_rate, changes, scraped_at, now=None) -> float:
+    """Blends the changes per hour seen since the previous scrape into the rate.
+
+    The first scrape of an item only loads it, so it is not counted as change.
+    """
+    if scraped_at is None:
+        return change_rate
+    now = now or timezone.now()
+    hours = max((now - scraped_at).total_seconds() / 3600, 1 / 60)
+    return (
+        CHANGE_RATE_SMOOTHING * changes / hours
+        + (1 - CHANGE_RATE_SMOOTHING) * change_rate
+    )
+
+
+def get_priority(scraped_at, change_rate, product_count=None, now=None):
+    """Returns an SQL expression of staleness weighted by volatility.
+
+    The expression is ``NULL`` for items never scraped, so ordering by it
+    descending with nulls first puts those first. Items with a
+    ``product_count`` below ``UNDERFILLED_PRODUCT_COUNT`` are boosted in
+    proportion to how many products they are missing.
+    """
+    now = now or timezone.now()
+    priority = (Value(now) - F(scraped_at)) * (Value(1.0) + F(change_rate))
+    if product_count is not None:
+        priority *= Value(2.0) - Least(
+            F(product_count), Value(UNDERFILLED_PRODUCT_COUNT)
+        ) / Value(float(UNDERFILLED_PRODUCT_COUNT))
+    return ExpressionWrapper(priority, output_field=DurationField())
+
+
+def order_stale(queryset, scraped_at, change_rate, product_count=None, now=None):
+    """Orders items never scraped first, then the most stale and volatile."""
+    return queryset.order_by(
+        get_priority(scraped_at, change_rate, product_count, now).desc(nulls_first=True)
+    )
@@ -0,0 +1,112 @@
+import threading
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that reports requests served by new versus reused connections."""
+
+    def connection_counts(self) -> tuple[int, int]:
+        """Returns ``(new_connections, reused_connections)`` of the live pools."""
+        new_connections = served_requests = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new_connections += pool.num_connections
+            served_requests += pool.num_requests
+        return new_connections, max(served_requests - new_connections, 0)
+
+
+class HostSession:
+    def __init__(self, pool_connections, pool_maxsize):
+        self.adapter = CountingHTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        self.session = requests.Session()
+        self.session.headers["Connection"] = "keep-alive"
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.requests = 0
+
+    def close(self):
+        self.session.close()
+
+
+class SessionManager:
+    """Keeps one long-lived, pooled ``requests.Session`` per upstream host.
+
+    Sessions are recycled after ``max_requests`` requests or when a request
+    fails, so broken or stale connections are never reused for long.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, max_requests=None):
+        self.pool_connections = pool_connections or settings.WB_POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or settings.WB_POOL_MAXSIZE
+        self.max_requests = max_requests or settings.WB_SESSION_MAX_REQUESTS
+        self._sessions = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def get(self, url) -> requests.Session:
+        """Returns the pooled session for the host of the given URL."""
+        host = urlparse(url).netloc
+        with self._lock:
+            host_session = self._sessions.get(host)
+            if host_session and host_session.requests >= self.max_requests:
+                self._close(host)
+                host_session = None
+            if not host_session:
+                host_session = HostSession(self.pool_connections, self.pool_maxsize)
+                self._sessions[host] = host_session
+            host_session.requests += 1
+            return host_session.session
+
+    def recycle(self, url):
+        """Drops the session of the URL's host, e.g. after a connection error."""
+        with self._lock:
+            self._close(urlparse(url).netloc)
+
+    def close(self):
+        with self._lock:
+            for host in list(self._sessions):
+                self._close(host)
+
+    def _close(self, host):
+        host_session = self._sessions.pop(host, None)
+        if not host_session:
+            return
+        totals = self._totals.setdefault(host, self._empty_stats())
+        self._add_stats(totals, host_session)
+        totals["recycles"] += 1
+        host_session.close()
+
+    def stats(self) -> dict:
+        """Returns per-host counters of requests, new and reused connections."""
+        with self._lock:
+            stats = {host: dict(totals) for host, totals in self._totals.items()}
+            for host, host_session in self._sessions.items():
+                self._add_stats(
+                    stats.setdefault(host, self._empty_stats()), host_session
+                )
+        return stats
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "recycles": 0,
+        }
+
+    @staticmethod
+    def _add_stats(stats, host_session):
+        new_connections, reused_connections = host_session.adapter.connection_counts()
+        stats["requests"] += host_session.requests
+        stats["new_connections"] += new_connections
+        stats["reused_connections"] += reused_connections
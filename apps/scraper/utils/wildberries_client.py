@@ -1,27 +1,64 @@
-import json
-import random
-from datetime import datetime, timedelta, timezone
+import time
+from functools import partial
+from urllib.parse import urlparse
 
+import ijson
 import requests
-from bs4 import BeautifulSoup
-from dateutil.parser import ParserError, parse
-from django.db import IntegrityError, transaction
-from django.db.models import Count, Q
+import urllib3
+from core.metrics import metrics
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone as django_timezone
 from fake_useragent import UserAgent
-from requests_html import HTMLSession
 from scraper.models import (
     Category,
     Comment,
-    CommentFiles,
     CommentStatuses,
-    FileTypeChoices,
+    FeedbackCursor,
     Product,
 )
+from scraper.utils.baskets import BasketResolver
+from scraper.utils.categories import (
+    CategoryCache,
+    CategorySource,
+    add_category_products,
+    find_breadcrumb_slug,
+    sync_categories,
+)
+from scraper.utils.fetcher import AsyncFetcher
+from scraper.utils.ingest import (
+    advance_feedback_cursors,
+    backfill_product_image_links,
+    empty_report,
+    get_feedback_cursors,
+    ingest_feedbacks,
+    iter_wanted_feedbacks,
+    merge_reports,
+    select_new_feedbacks,
+    upsert_products,
+)
+from scraper.utils.matching import TitleMatcher
+from scraper.utils.notify import send_no_product_message
+from scraper.utils.probe import MediaProbe
+from scraper.utils.rate_limit import RateLimiter
+from scraper.utils.resilience import CircuitBreaker, Resilience
+from scraper.utils.resolution import ProductLookupError, release_product_resolution
+from scraper.utils.schedule import order_stale, update_change_rate
+from scraper.utils.sessions import SessionManager
 
 
 class WildberriesClient:
     def __init__(self):
         self.ua = UserAgent()
+        self.sessions = SessionManager()
+        self.rate_limiter = RateLimiter()
+        self.resilience = Resilience()
+        self.fetcher = AsyncFetcher(self.send_request)
+        self.media_probe = MediaProbe(self)
+        self.baskets = BasketResolver(self.media_probe.check)
+        self.category_source = CategorySource(self)
+        self.category_cache = CategoryCache()
 
     def get_headers(self, url):
         return {
@@ -33,288 +70,365 @@ class WildberriesClient:
             "Host": "catalog.wb.ru",
         }
 
+    @staticmethod
+    def get_upstream_url(url):
+        """Points a Wildberries URL at ``WB_UPSTREAM_URL`` when a stand-in is set.
+
+        The stand-in receives the original host as the first path segment.
+        """
+        if not settings.WB_UPSTREAM_URL:
+            return url
+        parsed_url = urlparse(url)
+        query = f"?{parsed_url.query}" if parsed_url.query else ""
+        return f"{settings.WB_UPSTREAM_URL.rstrip('/')}/{parsed_url.netloc}{parsed_url.path}{query}"
+
+    def request(self, method, url, headers=None, **kwargs) -> requests.Response:
+        """Sends a request with retries, guarded by the host's circuit breaker."""
+        return self.resilience.call(
+            url, lambda: self.send(method, url, headers=headers, **kwargs)
+        )
+
+    def send(self, method, url, headers=None, **kwargs) -> requests.Response:
+        """Sends a single request through the pooled session of the URL's host."""
+        kwargs.setdefault("timeout", settings.WB_REQUEST_TIMEOUT)
+        host = urlparse(url).netloc
+        self.rate_limiter.acquire(url)
+        session = self.sessions.get(url)
+        try:
+            with metrics.timer("wb_http_request_seconds", host=host):
+                response = session.request(
+                    method,
+                    self.get_upstream_url(url),
+                    headers={**self.get_headers(url), **(headers or {})},
+                    **kwargs,
+                )
+        except requests.exceptions.RequestException:
+            self.sessions.recycle(url)
+            self.rate_limiter.feedback(url, None)
+            raise
+        self.rate_limiter.feedback(url, response)
+        metrics.inc("wb_http_responses_total", host=host, status=response.status_code)
+        # A streamed body is not read yet, so only its announced length is known
+        size = (
+            response.headers.get("Content-Length", 0)
+            if kwargs.get("stream")
+            else len(response.content)
+        )
+        metrics.inc("wb_http_response_bytes_total", int(size), host=host)
+        return response
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
     def send_request(self, url):
         data = {}
         try:
-            session = HTMLSession()
-            response = session.get(url, headers=self.get_headers(url), timeout=10)
+            response = self.get(url)
             if response.status_code == 200:
                 try:
-                    data = response.json()
+                    with metrics.timer(
+                        "wb_json_decode_seconds", host=urlparse(url).netloc
+                    ):
+                        data = response.json()
                 except requests.exceptions.JSONDecodeError as exc:
                     data = {}
         except requests.exceptions.RequestException as exc:
             pass
         return data
 
-    def get_soup(
-        self, url: str = None, image: bool = False
-    ) -> BeautifulSoup | None | str:
-        """Returns a BeautifulSoup object of the requested URL's HTML content."""
-        try:
-            session = HTMLSession()
-            response = session.get(url, headers=self.get_headers(url))
-
-            content_type = response.headers.get("Content-Type", "")
-            if "image" in content_type and image:
-                return "image"
-            if response.status_code != 200:
-                return None
-        except requests.exceptions.ConnectionError:
-            return None
-        return BeautifulSoup(response.content, "html.parser")
-
-    def check_image(self, image_url: str) -> bool:
-        """Checks if an image exists at the given URL."""
-        soup = self.get_soup(image_url, image=True)
-        if isinstance(soup, str) and soup == "image":
-            return True
-        elif isinstance(soup, BeautifulSoup):
-            title = soup.find("title")
-            if title and hasattr(title, "text") and title.text != "404 Not Found":
-                return True
-        return False
+    def get_feedbacks(self, url) -> dict:
+        """Returns the feedbacks of a root worth ingesting, decoded as a stream.
 
-    def get_categories(self):
-        """Fetches and saves categories and subcategories from Wildberries."""
+        Feedbacks are filtered while the body is read, so large payloads of
+        popular roots are never decoded into memory as a whole.
+        """
+        try:
+            with self.get(url, stream=True) as response:
+                if response.status_code != 200:
+                    return {}
+                response.raw.decode_content = True
+                with metrics.timer("wb_json_decode_seconds", host=urlparse(url).netloc):
+                    return {"feedbacks": list(iter_wanted_feedbacks(response.raw))}
+        except (
+            requests.exceptions.RequestException,
+            urllib3.exceptions.HTTPError,
+            ijson.JSONError,
+        ):
+            return {}
 
-        # Step 1: Retrieve top-level categories from the database
-        top_categories = Category.objects.all().order_by("?")
-
-        # Step 2: Fetch Wildberries categories data
-        with open("apps/scraper/fixtures/categories.json", encoding="utf-8") as file:
-            wildberries_categories = json.load(file)
-
-        # Step 3: Iterate over top-level categories from the database
-        for top_category in top_categories:
-            # Find the corresponding Wildberries top-level category by source_id
-            matching_wb_category = next(
-                (
-                    wb_cat
-                    for wb_cat in wildberries_categories
-                    if wb_cat["id"] == top_category.source_id
-                ),
-                None,
+    def get_catalog_url(self, category, fallback=False, page=1, currency="rub"):
+        if fallback:
+            url = (
+                f"https://catalog.wb.ru/catalog/{category.shard}/v2/catalog?ab_pers_testid=newlogscore"
+                f"&ab_rec_testid=newlogscore&ab_testid=newlogscore&appType=1&cat={category.source_id}&curr={currency}&dest=491&sort"
+                "=popular&spp=30&uclusters=0"
+            )
+        else:
+            url = (
+                f"http://catalog.wb.ru/catalog/{category.shard}/v2/catalog"
+                f"?ab_testing=false&appType=1&cat={category.source_id}&curr={currency}&dest=491&sort=popular&spp=30"
+                f"&uclusters=0"
             )
+        if page > 1:
+            url = f"{url}&page={page}"
+        return url
+
+    def iter_catalog(
+        self,
+        category,
+        known_source_ids=None,
+        first_page=None,
+        max_pages=None,
+        max_products=None,
+        max_seconds=None,
+    ):
+        """Yields the products of a category catalog page by page.
+
+        Stops at the first empty page, after a page made only of already known
+        ``source_id``s, or when the page, product or time limit is reached.
+        ``first_page`` can carry already fetched data of the first page.
+        """
+        known_source_ids = known_source_ids or set()
+        max_pages = max_pages or settings.WB_CATALOG_MAX_PAGES
+        max_products = max_products or settings.WB_CATALOG_MAX_PRODUCTS
+        max_seconds = max_seconds or settings.WB_CATALOG_MAX_SECONDS
+        started_at = time.monotonic()
+        yielded = 0
+
+        for page in range(1, max_pages + 1):
+            if page == 1 and first_page is not None:
+                data = first_page
+            else:
+                data = self.send_request(self.get_catalog_url(category, page=page))
+            products = data.get("data", {}).get("products", [])[
+                : max_products - yielded
+            ]
+            if not products:
+                return
 
-            if not matching_wb_category:
-                continue
+            only_known = all(
+                product.get("id") in known_source_ids for product in products
+            )
+            yield products
+            yielded += len(products)
 
-            # Step 4: Get subcategories (childs) for the top-level category
-            subcategories = matching_wb_category.get("childs", [])
-
-            # Step 5: Save each subcategory to the database
-            for subcategory in subcategories:
-                subcategory_name = subcategory["name"]
-                existing_subcategory = Category.objects.filter(
-                    title=subcategory_name, parent=top_category
-                ).first()
-
-                # Handle duplicate subcategory names by appending the top-level category name
-                if existing_subcategory:
-                    subcategory_name = f"{subcategory_name} {top_category.title}"
-                    existing_subcategory.title = subcategory_name
-                    try:
-                        existing_subcategory.save(update_fields=["title"])
-                    except IntegrityError:
-                        pass
-                    continue
+            if (
+                only_known
+                or yielded >= max_products
+                or time.monotonic() - started_at >= max_seconds
+            ):
+                return
 
-                try:
-                    Category.objects.create(
-                        source_id=subcategory["id"],
-                        title=subcategory_name,
-                        slug_name=subcategory.get("url", ""),
-                        shard=subcategory.get("shard", ""),
-                        parent=top_category,
-                    )
-                except IntegrityError:
-                    pass
-
-    def get_categories_with_few_products(self, initial_limit=10, max_limit=100):  # noqa
-        limit = initial_limit
-
-        # Loop until we find categories or reach the max limit
-        while limit <= max_limit:
-            # Annotate each category with a count of related products
-            categories = (
-                Category.objects.annotate(product_count=Count("products"))
-                .filter(product_count__lt=limit)
-                .order_by("?")  # Random order
+    def fetch_catalogs(self, categories):
+        """Fetches catalog pages of the given categories concurrently.
+
+        Yields ``(category, data)`` pairs batch by batch; categories whose
+        primary URL returned nothing are retried once with the fallback URL.
+        """
+        categories = list(categories)
+        batch_size = settings.WB_FETCH_BATCH_SIZE
+        for start in range(0, len(categories), batch_size):
+            end = start + batch_size
+            batch = categories[start:end]
+            results = self.fetcher.fetch_many(
+                self.get_catalog_url(category) for category in batch
             )
+            fallback_results = self.fetcher.fetch_many(
+                self.get_catalog_url(category, fallback=True)
+                for category in batch
+                if not results.get(self.get_catalog_url(category))
+            )
+            for category in batch:
+                data = results.get(self.get_catalog_url(category)) or (
+                    fallback_results.get(self.get_catalog_url(category, fallback=True))
+                )
+                yield category, data or {}
 
-            # If we found matching categories, return them
-            if categories.exists():
-                return categories
-
-            # Increase the limit and try again
-            limit += 10
+    @metrics.timed("scraper_stage_seconds", stage="get_categories")
+    def get_categories(self):
+        """Fetches and saves categories and subcategories from Wildberries."""
+        return sync_categories(self.category_source.get_fixture_menu())
 
-        # Return empty if no matching categories were found even after reaching max limit
-        return Category.objects.none()
+    @staticmethod
+    def get_stale_categories(limit=None) -> list[Category]:
+        """Returns the categories to scrape, the most stale and volatile first.
 
-    def update_products(self):
-        currency = "rub"
+        Categories with few products are ranked ahead of equally stale ones.
 
-        for product in Product.objects.filter(source_id__isnull=True):
-            category = product.category
-            if not category:
-                continue
+        By default as many categories are picked as fit into the request
+        budget of a products pass when every catalog is read to its page limit.
+        """
+        limit = limit or max(
+            settings.SCRAPE_PRODUCTS_REQUEST_BUDGET // settings.WB_CATALOG_MAX_PAGES, 1
+        )
+        categories = order_stale(
+            Category.objects.filter(
+                source_id__isnull=False, shard__isnull=False
+            ).exclude(shard=""),
+            "scraped_at",
+            "change_rate",
+            "product_count",
+        )
+        return list(categories[:limit])
 
-            # Construct the URL for the API request
-            url = (
-                f"http://catalog.wb.ru/catalog/{category.shard}/v2/catalog"
-                f"?ab_testing=false&appType=1&cat={category.source_id}&curr={currency}&dest=491&sort=popular&spp=30"
-                f"&uclusters=0"
+    @metrics.timed("scraper_stage_seconds", stage="update_products")
+    def update_products(self):
+        """Finds the source_id of products added without one.
+
+        Pending products are grouped by category, so every catalog is fetched
+        once, and all pending titles of a category are matched against it in
+        a single pass. Matches are written back in one bulk update.
+        """
+        pending = {}
+        for product in Product.objects.filter(
+            source_id__isnull=True, category__isnull=False
+        ).select_related("category"):
+            pending.setdefault(product.category, []).append(product)
+
+        matched = {}
+        for category, data in self.fetch_catalogs(pending):
+            products = {product.pk: product for product in pending[category]}
+            matcher = TitleMatcher(
+                {product.pk: product.title for product in products.values()}
             )
-            # Send request to get product data
-            data = self.send_request(url)
-
-            # Extract a product list from the API response
-            products_data = data.get("data", {}).get("products", [])
-
-            # Search for the product title in the products_data
-            for item in products_data:
-                product_title = item.get("name", "").lower()
-                target_title = product.title.lower()
-
-                # Check if the target title is found in the product title
-                if target_title in product_title:
-                    product.source_id = item.get("id")
-                    product.save(update_fields=["source_id"])
-                    break  # Exit the loop once a match is found
-
-    def update_product_image_links(self):
-        queryset = Product.objects.filter(image_link__isnull=True).order_by("?")
-        for product in queryset:
-            comment = (
-                Comment.objects.filter(
-                    Q(
-                        Q(file__isnull=False, file_type=FileTypeChoices.IMAGE)
-                        | Q(files__isnull=False, files__file_type=FileTypeChoices.IMAGE)
-                    ),
-                    status=CommentStatuses.ACCEPTED,
-                    content__isnull=False,
-                    product=product,
-                )
-                .prefetch_related("files")
-                .first()
+            for item in data.get("data", {}).get("products", []):
+                source_id = item.get("id")
+                if not source_id or source_id in matched:
+                    continue
+                for pk in matcher.find(item.get("name", "")):
+                    product = products.pop(pk, None)
+                    if product:
+                        product.source_id = source_id
+                        matched[source_id] = product
+                        break
+
+        taken_source_ids = set(
+            Product.objects.filter(source_id__in=matched).values_list(
+                "source_id", flat=True
             )
-            if not comment:
-                continue
+        )
+        resolved = [
+            product
+            for source_id, product in matched.items()
+            if source_id not in taken_source_ids
+        ]
+        Product.objects.bulk_update(resolved, ["source_id"], batch_size=500)
+        return {
+            "pending": sum(len(products) for products in pending.values()),
+            "matched": len(resolved),
+        }
 
-            image_link = None
-            if comment.file:
-                image_link = comment.file.url
-            else:
-                first_file = comment.files.first()
-                if first_file and first_file.file_type == FileTypeChoices.IMAGE:
-                    image_link = first_file.file_link
-            if image_link:
-                product.image_link = image_link
-                product.save(update_fields=["image_link"])
-
-    def get_products(self, categories=None):
-        """Fetches and saves products and their variants."""
-        currency = "rub"
-        if not categories:
-            categories = self.get_categories_with_few_products(
-                max_limit=Product.objects.count()
-            )
-        existing_source_ids = set(Product.objects.values_list("source_id", flat=True))
+    @metrics.timed("scraper_stage_seconds", stage="update_product_image_links")
+    def update_product_image_links(self, batch_size=None):
+        return backfill_product_image_links(batch_size)
 
-        for category in categories:
-            url = (
-                f"http://catalog.wb.ru/catalog/{category.shard}/v2/catalog"
-                f"?ab_testing=false&appType=1&cat={category.source_id}&curr={currency}&dest=491&sort=popular&spp=30"
-                f"&uclusters=0"
+    def get_products(self, categories=None, existing_source_ids=None):
+        """Fetches and saves products and their variants.
+
+        Only categories whose catalog was actually read are marked as scraped.
+        """
+        if categories is None:
+            categories = self.get_stale_categories()
+        if existing_source_ids is None:
+            existing_source_ids = set(
+                Product.objects.values_list("source_id", flat=True)
             )
-            data = self.send_request(url)
 
+        report = empty_report("inserted", "updated", "skipped", "failed")
+        empty_categories = []
+        scraped_categories = []
+        now = django_timezone.now()
+        for category, data in self.fetch_catalogs(categories):
             if not data:
-                data = self.send_request(
-                    f"https://catalog.wb.ru/catalog/{category.shard}/v2/catalog?ab_pers_testid=newlogscore"
-                    f"&ab_rec_testid=newlogscore&ab_testid=newlogscore&appType=1&cat={category.source_id}&curr={currency}&dest=491&sort"
-                    "=popular&spp=30&uclusters=0"
-                )
-
-            products_data = data.get("data", {}).get("products", [])
-            if not products_data:
-                sub_categories = category.sub_categories.all()
-                if sub_categories:
-                    self.get_products(sub_categories)
-            random.shuffle(products_data)
-            roots = {}
-            for product in products_data:
-                roots.setdefault(product["root"], []).append(product)
-
-            for root, products in roots.items():
-                self.save_products_and_variants(
-                    category, root, products, existing_source_ids
-                )
-
-    @transaction.atomic
-    def save_products_and_variants(self, category, root, products, existing_source_ids):
-        """Saves products and their variants"""
-        for product in products:
-            source_id = product["id"]
-            if source_id in existing_source_ids:
+                # The request failed; keep the category stale for the next pass
+                report["failed"] += 1
                 continue
+            scraped = 0
+            category_report = empty_report()
+            for products_data in self.iter_catalog(
+                category, existing_source_ids, first_page=data
+            ):
+                scraped += len(products_data)
+                merge_reports(
+                    category_report,
+                    self.save_products_and_variants(
+                        category, products_data, existing_source_ids
+                    ),
+                )
+            merge_reports(report, category_report)
 
-            data = {
-                "title": product.get("name"),
-                "source_id": source_id,
-                "defaults": {
-                    "category": category,
-                    "root": int(root),
-                },
-            }
-
-            try:
-                Product.objects.get_or_create(**data)
-            except Exception:
-                pass
+            category.change_rate = update_change_rate(
+                category.change_rate,
+                category_report["inserted"],
+                category.scraped_at,
+                now,
+            )
+            category.scraped_at = now
+            scraped_categories.append(category)
+            if not scraped:
+                empty_categories.append(category)
+        Category.objects.bulk_update(
+            scraped_categories, ["scraped_at", "change_rate"], batch_size=500
+        )
 
-    def get_category_by_slug_name(self, slug_name):
-        wildberries_categories = self.send_request(
-            "https://static-basket-01.wb.ru/vol0/data/main-menu-ru-ru-v2.json"
+        sub_categories = Category.objects.filter(parent__in=empty_categories)
+        if empty_categories and sub_categories.exists():
+            merge_reports(
+                report, self.get_products(sub_categories, existing_source_ids)
+            )
+        return report
+
+    @metrics.timed("scraper_stage_seconds", stage="get_category_products")
+    def get_category_products(self, category_id):
+        """Fetches and saves the products of a single category."""
+        return self.get_products(
+            Category.objects.filter(pk=category_id),
+            set(
+                Product.objects.filter(category_id=category_id).values_list(
+                    "source_id", flat=True
+                )
+            ),
         )
 
-        # Iterate through the categories to find a match
-        for category in wildberries_categories:
-            # Check if the slug_name is present in the 'url' field
-            if slug_name in category["url"]:
-                return category
+    def save_products_and_variants(self, category, products, existing_source_ids):
+        """Saves a catalog page of products and their variants in bulk."""
+        return upsert_products(category, products, existing_source_ids)
 
-            # If the category has children, search in them as well
-            if "childs" in category:
-                for subcategory in category["childs"]:
-                    if slug_name in subcategory["url"]:
-                        return subcategory
+    def get_category_by_slug_name(self, slug_name):
+        menu = self.category_source.get_menu()
+        category = menu.get_by_slug(slug_name) if menu else None
+        return category._asdict() if category else None
 
-        # If no category is found
-        return None
+    def get_product_category_slug(self, source_id) -> str | None:
+        try:
+            with self.get(
+                f"https://www.wildberries.ru/catalog/{source_id}/detail.aspx",
+                stream=True,
+            ) as response:
+                if response.status_code != 200:
+                    return None
+                return find_breadcrumb_slug(
+                    response.iter_content(settings.WB_PRODUCT_PAGE_CHUNK_SIZE)
+                )
+        except requests.exceptions.RequestException:
+            return None
 
     def get_product_category(self, source_id) -> Category | None:
-        variant_detail_soup = self.get_soup(
-            f"https://www.wildberries.ru/catalog/{source_id}/detail.aspx"
-        )
-        if not variant_detail_soup:
-            return None
+        """Returns the category of a product.
 
-        product_page = variant_detail_soup.find("div", {"class": "product-page"})
-        if not product_page:
-            return None
-        breadcrumb_ul = product_page.find_next("ul", {"class": "breadcrumbs__list"})
-        if not breadcrumb_ul:
-            return None
-        breadcrumbs = breadcrumb_ul.find_all("li", {"class": "breadcrumbs__item"})
-        if not breadcrumbs:
+        The category slug is read from the product page breadcrumb; the
+        category itself is resolved from the category cache when possible.
+        """
+        slug_name = self.get_product_category_slug(source_id)
+        if not slug_name:
             return None
-        anchor_tag = breadcrumbs[1].find_next("a", {"class": "breadcrumbs__link"})
-        if not anchor_tag:
-            return None
-        slug_name = anchor_tag["href"]
+
+        category = self.category_cache.get(slug_name)
+        if category:
+            return category
         category = Category.objects.filter(slug_name=slug_name).last()
         if not category:
             category_data = self.get_category_by_slug_name(slug_name)
@@ -328,25 +442,37 @@ class WildberriesClient:
                     parent__source_id=category_data.get("parent")
                 ).first(),
             )
+        # A category created inside a rolled back transaction must not be cached
+        transaction.on_commit(partial(self.category_cache.set, slug_name, category))
         return category
 
     @transaction.atomic
     def get_product_by_source_id(self, source_id: int) -> Product | None:
-        """Scrapes a product and its variants by the given source_id."""
+        """Scrapes a product and its variants by the given source_id.
+
+        Returns ``None`` only when Wildberries answered that the article has
+        no product; raises ``ProductLookupError`` when that is unknown.
+        """
         currency = "rub"
         url = f"https://card.wb.ru/cards/v2/detail?appType=1&curr={currency}&dest=491&spp=30&ab_testing=false&nm={source_id}"
-        product_data = self.send_request(url)
-        if not product_data:
-            return None
-
-        if not product_data.get("data"):
-            return None
+        try:
+            response = self.get(url)
+        except requests.exceptions.RequestException as exc:
+            raise ProductLookupError(f"Card request of {source_id} failed") from exc
+        if response.status_code != 200:
+            raise ProductLookupError(
+                f"Card request of {source_id} returned {response.status_code}"
+            )
+        try:
+            product_data = response.json()
+        except requests.exceptions.JSONDecodeError as exc:
+            raise ProductLookupError(f"Card of {source_id} is not JSON") from exc
 
-        products = product_data["data"]["products"]
+        products = (product_data.get("data") or {}).get("products")
         if isinstance(products, list) and len(products) > 0:
             product_info = products[0]
         else:
-            return
+            return None
 
         _data = {
             "root": product_info["root"],
@@ -358,130 +484,137 @@ class WildberriesClient:
         }
 
         try:
-            product_object, _ = Product.objects.get_or_create(**_data)
-        except Exception:
-            product_object = None
-
+            product_object, created = Product.objects.get_or_create(**_data)
+        except Exception as exc:
+            raise ProductLookupError(f"Product {source_id} was not saved") from exc
+        if created:
+            add_category_products(product_object.category_id, 1)
         return product_object
 
-    def get_product_comments(self):
-        """Fetches and saves product comments."""
-        products = Product.objects.values("root", "id").order_by("?")
-        roots = set()
-
-        for product in products:
-            root = product["root"]
-            if root in roots:
-                continue
-            roots.add(root)
-
-            url = f"https://feedbacks2.wb.ru/feedbacks/v1/{root}"
-            data = self.send_request(url)
-
-            feedbacks = data.get("feedbacks", [])
-            if not feedbacks:
-                continue
-
-            for comment in feedbacks:
-                self.save_comment(comment, product["id"])
-
-    @transaction.atomic
-    def save_comment(self, comment, product_id):
-        """Saves a comment and its images."""
-        created_date = comment.get("createdDate")
-        try:
-            published_date = (
-                parse(created_date, yearfirst=True) if created_date else None
-            )
-        except ParserError:
-            published_date = None
-
-        if (
-            not published_date
-            or (datetime.now(timezone.utc) - timedelta(weeks=2)) > published_date
-        ):
-            return
-
-        rating = comment.get("productValuation", 0)
-        if rating != 5:
-            return
-
-        if comment.get("text"):
-            comment_object, _ = Comment.objects.get_or_create(
-                product_id=product_id,
-                content=comment.get("text"),
-                defaults={
-                    "rating": rating,
-                    "status": CommentStatuses.ACCEPTED,
-                    "wb_user": comment.get("wbUserDetails", {}).get("name", ""),
-                    "source_date": published_date,
-                },
-            )
-
-            images_saved = self.save_comment_images(
-                comment_object, comment.get("photo", [])
-            )
-            video_saved = self.save_comment_videos(
-                comment_object, comment.get("video", None)
-            )
-
-            if not images_saved and not video_saved:
-                comment_object.delete()
-                return
-
-            if (
-                comment_object.product
-                and not comment_object.product.image_link
-                and images_saved
-            ):
-                file = images_saved[0]
-                comment_object.product.image_link = file.file_link
-                comment_object.product.save(update_fields=["image_link"])
-
-    def save_comment_images(self, comment_object, photo_ids):
-        """Saves images associated with a comment."""
-        image_objects = []
-
-        for photo_id in photo_ids:
-            photo_id = str(photo_id)
-            link = None
-            for basket_id in range(1, 11):
-                img_url = f"https://feedback0{basket_id}.wbbasket.ru/vol{photo_id[:4]}/part{photo_id[:6]}/{photo_id}/photos/ms.webp"
-                if self.check_image(img_url):
-                    link = img_url
-                    break
-
-            if link:
-                image_objects.append(
-                    CommentFiles(
-                        comment=comment_object,
-                        file_link=link,
-                        file_type=FileTypeChoices.IMAGE,
+    @metrics.timed("scraper_stage_seconds", stage="resolve_comment_product")
+    def resolve_comment_product(self, source_id: int) -> int:
+        """Attaches the product to every accepted comment waiting for it.
+
+        When Wildberries answers that the product does not exist, the comments
+        are deleted and their authors notified. Returns the number of comments;
+        ``ProductLookupError`` is raised when the lookup has to be retried.
+        """
+        product = Product.objects.filter(
+            source_id=source_id
+        ).first() or self.get_product_by_source_id(source_id)
+        # Comments saved from now on are not covered by this lookup
+        release_product_resolution(source_id)
+
+        comments = Comment.objects.filter(
+            product_source_id=source_id,
+            product__isnull=True,
+            status=CommentStatuses.ACCEPTED,
+            requestedcomment__isnull=True,
+        )
+        if product:
+            return comments.update(product=product)
+
+        count = 0
+        for comment in comments.select_related("user"):
+            send_no_product_message(comment, source_id)
+            comment.delete()
+            count += 1
+        return count
+
+    @staticmethod
+    def get_root_products(roots=None) -> dict:
+        """Returns the first product of every root, or of the given roots."""
+        products = Product.objects.filter(root__isnull=False)
+        if roots is not None:
+            products = products.filter(root__in=roots)
+        root_products = {}
+        for root, product_id in products.order_by("id").values_list("root", "id"):
+            root_products.setdefault(root, product_id)
+        return root_products
+
+    @staticmethod
+    def get_stale_roots(limit=None) -> list:
+        """Returns roots never checked first, then by staleness and change rate.
+
+        Unchecked roots are found with an anti-join on the cursor table and
+        checked ones are ranked on it, so only the picked roots leave the
+        database.
+        """
+        checked = FeedbackCursor.objects.filter(checked_at__isnull=False)
+        roots = list(
+            Product.objects.filter(root__isnull=False)
+            .exclude(Exists(checked.filter(root=OuterRef("root"))))
+            .order_by("root")
+            .values_list("root", flat=True)
+            .distinct()[:limit]
+        )
+        if limit is None or len(roots) < limit:
+            ranked = order_stale(
+                checked.filter(Exists(Product.objects.filter(root=OuterRef("root")))),
+                "checked_at",
+                "change_rate",
+            ).values_list("root", flat=True)
+            roots += ranked[: limit - len(roots) if limit else None]
+        return roots
+
+    @metrics.timed("scraper_stage_seconds", stage="get_product_comments")
+    def get_product_comments(self, roots=None):
+        """Fetches and saves product comments of all roots or the given ones.
+
+        The stalest and most often changing roots are checked first. Feedbacks
+        are filtered while their response is decoded, and the ones up to each
+        root's cursor are skipped without touching the database.
+        """
+        if roots is None:
+            roots = self.get_stale_roots()
+        root_products = self.get_root_products(roots)
+        ordered_roots = [root for root in roots if root in root_products]
+
+        urls = {
+            f"https://feedbacks2.wb.ru/feedbacks/v1/{root}": root
+            for root in ordered_roots
+        }
+        report = {}
+        for results in self.fetcher.iter_batches(urls, fetch=self.get_feedbacks):
+            cursors = get_feedback_cursors(urls[url] for url in results)
+            feedbacks_by_root = {}
+            feedbacks_by_product = {}
+            for url, data in results.items():
+                if not data:
+                    continue
+                root = urls[url]
+                feedbacks = data.get("feedbacks") or []
+                feedbacks_by_root[root] = feedbacks
+                new_feedbacks = select_new_feedbacks(feedbacks, cursors.get(root))
+                if new_feedbacks:
+                    feedbacks_by_product.setdefault(root_products[root], []).extend(
+                        new_feedbacks
                     )
-                )
-        if image_objects:
-            files = CommentFiles.objects.bulk_create(
-                image_objects, ignore_conflicts=True
+            unresolved = set()
+            merge_reports(
+                report, ingest_feedbacks(self, feedbacks_by_product, unresolved)
             )
-            return files
-        return None
-
-    def save_comment_videos(self, comment_object, video):
-        """Saves videos associated with a comment."""
-        if isinstance(video, dict):
-            basket_id, uuid = video["id"].split("/")
-            link = "https://videofeedback0{}.wbbasket.ru/{}/index.m3u8".format(
-                basket_id, uuid
+            advance_feedback_cursors(feedbacks_by_root, cursors, unresolved)
+        return report
+
+    def export_stats(self):
+        """Sets the connection, rate limit and circuit breaker stats as gauges.
+
+        The gauges hold the totals of this process as last flushed by it.
+        """
+        for host, stats in self.sessions.stats().items():
+            for name, value in stats.items():
+                metrics.set(f"wb_session_{name}", value, host=host)
+        for host, stats in self.rate_limiter.stats().items():
+            metrics.set("wb_rate_limit_rate", stats["rate"], host=host)
+            metrics.set("wb_rate_limit_factor", stats["factor"], host=host)
+        resilience = self.resilience.stats()
+        metrics.set("wb_retries", resilience["retries"])
+        for key, breaker in resilience["breakers"].items():
+            metrics.set(
+                "wb_breaker_open", int(breaker["state"] == CircuitBreaker.OPEN), key=key
             )
-            if link:
-                comment = CommentFiles.objects.filter(comment=comment_object)
-                if not comment:
-                    files = CommentFiles.objects.get_or_create(
-                        comment=comment_object,
-                        file_type=FileTypeChoices.VIDEO,
-                        defaults={
-                            "file_link": link,
-                        },
-                    )
-                    return files
-        return None
+            metrics.set("wb_breaker_failures", breaker["failures"], key=key)
+            metrics.set("wb_breaker_trips", breaker["trips"], key=key)
+        for name, value in self.baskets.stats().items():
+            metrics.set(f"wb_basket_{name}", value)
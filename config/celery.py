@@ -1,8 +1,13 @@
 import os
+import time
+from functools import wraps
 
+import requests
+from celery.signals import task_postrun, task_prerun
+from celery.states import READY_STATES
 from django.conf import settings
 
-from celery import Celery
+from celery import Celery, chord
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -32,8 +37,96 @@ app.conf.beat_schedule = {
         "task": "update_product_image_links",
         "schedule": 100,
     },
+    "reconcile_category_product_counts": {
+        "task": "reconcile_category_product_counts",
+        "schedule": settings.RECONCILE_CATEGORY_PRODUCT_COUNTS_SECONDS,
+    },
 }
 app.conf.timezone = "Asia/Tashkent"
+# Product lookups of user comments run on their own worker, not behind scraping
+app.conf.task_routes = {"resolve_comment_product": {"queue": "resolution"}}
+
+# Tasks that record a ScrapeRun; their subtasks only add to the metrics
+RECORDED_TASKS = {
+    "scrape_categories",
+    "scrape_products",
+    "scrape_comments",
+    "update_products",
+    "update_product_image_links",
+    "reconcile_category_product_counts",
+    "aggregate_scrape_reports",
+}
+SKIPPED = {"skipped": True}
+
+_task_starts = {}
+
+
+@task_prerun.connect
+def start_task_run(task_id=None, **kwargs):
+    from django.utils import timezone
+
+    _task_starts[task_id] = (timezone.now(), time.perf_counter())
+
+
+@task_postrun.connect
+def finish_task_run(task_id=None, task=None, retval=None, state=None, **kwargs):
+    """Records the metrics of a finished task and flushes them to Redis."""
+    from core.metrics import metrics
+    from scraper.models import ScrapeRun, ScrapeRunStatuses
+    from scraper.utils import wildberries
+
+    started_at, started = _task_starts.pop(task_id, (None, None))
+    if started_at is None:
+        return
+    duration = time.perf_counter() - started
+    metrics.observe("celery_task_seconds", duration, task=task.name)
+    metrics.inc("celery_tasks_total", task=task.name, state=state)
+    failed = isinstance(retval, BaseException)
+    if failed:
+        metrics.inc(
+            "celery_task_errors_total", task=task.name, error=type(retval).__name__
+        )
+    wildberries.export_stats()
+
+    try:
+        if task.name in RECORDED_TASKS:
+            if failed:
+                status = ScrapeRunStatuses.FAILURE
+            elif retval == SKIPPED:
+                status = ScrapeRunStatuses.SKIPPED
+            else:
+                status = ScrapeRunStatuses.SUCCESS
+            ScrapeRun.objects.create(
+                task=task.name,
+                task_id=task_id,
+                status=status,
+                started_at=started_at,
+                duration=duration,
+                error=repr(retval) if failed else None,
+                report=None if failed else retval,
+                metrics=metrics.snapshot(),
+            )
+    finally:
+        metrics.flush()
+
+
+def singleton_task(func):
+    """Skips a bound task while another run of it still holds its lease."""
+
+    @wraps(func)
+    def wrapper(task, *args, **kwargs):
+        from core.locks import acquire_singleton
+
+        lock = acquire_singleton(task.name)
+        if lock is None:
+            return SKIPPED
+        try:
+            with lock.heartbeat():
+                return func(task, *args, **kwargs)
+        finally:
+            lock.release()
+
+    return wrapper
 
 
 @app.task(bind=True)
@@ -42,35 +135,166 @@ def debug_task(self):
 
 
 @app.task(name="scrape_products", bind=True)
-def scrape_products(*args, **kwargs):
+def scrape_products(self, *args, **kwargs):
     from scraper.utils import wildberries
 
-    wildberries.get_products()
+    lock = acquire_pass(self.name)
+    if lock is None:
+        return SKIPPED
+    return dispatch_chord(
+        lock,
+        [
+            scrape_category_products.s(category.pk, lease=lock.lease)
+            for category in wildberries.get_stale_categories()
+        ],
+    )
+
+
+@app.task(name="scrape_category_products", bind=True)
+def scrape_category_products(self, category_id, *args, lease=None, **kwargs):
+    from core.locks import keep_lease
+    from scraper.utils import wildberries
+
+    with keep_lease(lease):
+        return wildberries.get_category_products(category_id)
 
 
 @app.task(name="scrape_comments", bind=True)
-def scrape_comments(*args, **kwargs):
+def scrape_comments(self, *args, **kwargs):
+    from scraper.utils import wildberries
+
+    lock = acquire_pass(self.name)
+    if lock is None:
+        return SKIPPED
+    roots = wildberries.get_stale_roots(settings.SCRAPE_COMMENTS_REQUEST_BUDGET)
+    batch_size = settings.SCRAPE_COMMENTS_ROOTS_PER_TASK
+    subtasks = []
+    for start in range(0, len(roots), batch_size):
+        end = start + batch_size
+        subtasks.append(scrape_root_comments.s(roots[start:end], lease=lock.lease))
+    return dispatch_chord(lock, subtasks)
+
+
+@app.task(name="scrape_root_comments", bind=True)
+def scrape_root_comments(self, roots, *args, lease=None, **kwargs):
+    from core.locks import keep_lease
     from scraper.utils import wildberries
 
-    wildberries.get_product_comments()
+    with keep_lease(lease):
+        return wildberries.get_product_comments(roots)
+
+
+@app.task(name="aggregate_scrape_reports", bind=True)
+def aggregate_scrape_reports(self, reports, lease, *args, **kwargs):
+    from core.locks import LeaseLock, clear_running_chord
+    from scraper.utils.ingest import merge_reports
+
+    clear_running_chord(lease[0], self.request.id)
+    LeaseLock(*lease).release()
+    report = {}
+    for subtask_report in reports:
+        merge_reports(report, subtask_report or {})
+    return {"name": lease[0], "subtasks": len(reports), **report}
+
+
+def is_chord_running(name) -> bool:
+    from core.locks import get_running_chord
+
+    task_id = get_running_chord(name)
+    return bool(task_id) and app.AsyncResult(task_id).state not in READY_STATES
+
+
+def acquire_pass(name):
+    """Acquires the lease of a fanned-out pass, or records a skipped run.
+
+    Subtasks waiting in the queue do not renew the lease, so it can expire
+    while the chord of the previous pass is still pending; the pass is then
+    skipped until that chord has finished.
+    """
+    from core.locks import acquire_singleton, record_skipped
+
+    lock = acquire_singleton(name)
+    if lock is not None and is_chord_running(name):
+        lock.release()
+        record_skipped(name)
+        return None
+    return lock
+
+
+def dispatch_chord(lock, subtasks):
+    """Runs the subtasks in parallel and merges their reports when all are done.
+
+    The subtasks keep the lease of ``lock`` alive and the aggregation releases
+    it, so the next pass does not start while this one is still running.
+    """
+    from core.locks import set_running_chord
+
+    if not subtasks:
+        lock.release()
+        return None
+    try:
+        result = chord(subtasks)(aggregate_scrape_reports.s(lock.lease))
+    except Exception:
+        lock.release()
+        raise
+    set_running_chord(lock.name, result.id)
+    return result.id
 
 
 @app.task(name="scrape_categories", bind=True)
+@singleton_task
 def scrape_categories(*args, **kwargs):
     from scraper.utils import wildberries
 
-    wildberries.get_categories()
+    return wildberries.get_categories()
 
 
 @app.task(name="update_products", bind=True)
+@singleton_task
 def update_products(*args, **kwargs):
     from scraper.utils import wildberries
 
-    wildberries.update_products()
+    return wildberries.update_products()
 
 
 @app.task(name="update_product_image_links", bind=True)
+@singleton_task
 def update_product_image_links(*args, **kwargs):
     from scraper.utils import wildberries
 
-    wildberries.update_product_image_links()
+    return wildberries.update_product_image_links()
+
+
+@app.task(
+    name="resolve_comment_product",
+    bind=True,
+    autoretry_for=(requests.exceptions.RequestException,),
+    retry_backoff=30,
+    retry_backoff_max=1800,
+    max_retries=8,
+)
+def resolve_comment_product(self, source_id, *args, **kwargs):
+    from scraper.utils import wildberries
+    from scraper.utils.resolution import (
+        hold_product_resolution,
+        release_product_resolution,
+    )
+
+    try:
+        return wildberries.resolve_comment_product(source_id)
+    except requests.exceptions.RequestException:
+        # New comments of the article must not queue more lookups while this
+        # one waits for a retry, but may do so once it gave up
+        if self.request.retries < self.max_retries:
+            hold_product_resolution(source_id, self.retry_backoff_max)
+        else:
+            release_product_resolution(source_id)
+        raise
+
+
+@app.task(name="reconcile_category_product_counts", bind=True)
+@singleton_task
+def reconcile_category_product_counts(*args, **kwargs):
+    from scraper.utils.categories import recount_category_products
+
+    return recount_category_products()
@@ -235,6 +235,77 @@ SCRAPE_CATEGORIES_SECONDS = env.float("SCRAPE_CATEGORIES_SECONDS")
 SCRAPE_PRODUCTS_SECONDS = env.float("SCRAPE_PRODUCTS_SECONDS")
 SCRAPE_COMMENTS_SECONDS = env.float("SCRAPE_COMMENTS_SECONDS")
 CACHE_PRODUCTS_AND_COMMENTS_SECONDS = env.float("CACHE_PRODUCTS_AND_COMMENTS_SECONDS")
+RECONCILE_CATEGORY_PRODUCT_COUNTS_SECONDS = env.float(
+    "RECONCILE_CATEGORY_PRODUCT_COUNTS_SECONDS", 3600.0
+)
+# Outgoing requests a products or comments pass may spend on the most stale items
+SCRAPE_PRODUCTS_REQUEST_BUDGET = env.int("SCRAPE_PRODUCTS_REQUEST_BUDGET", 2000)
+SCRAPE_COMMENTS_REQUEST_BUDGET = env.int("SCRAPE_COMMENTS_REQUEST_BUDGET", 5000)
+TASK_LOCK_TTL_SECONDS = env.float("TASK_LOCK_TTL_SECONDS", 600.0)
+# How long a dispatched chord keeps the next pass of its task from starting
+TASK_CHORD_TTL_SECONDS = env.float("TASK_CHORD_TTL_SECONDS", 21600.0)
+SCRAPE_COMMENTS_ROOTS_PER_TASK = env.int("SCRAPE_COMMENTS_ROOTS_PER_TASK", 500)
+RESOLVE_COMMENT_PRODUCT_LOCK_SECONDS = env.float(
+    "RESOLVE_COMMENT_PRODUCT_LOCK_SECONDS", 600.0
+)
+# Client addresses allowed to read the Prometheus metrics at /metrics/
+METRICS_ALLOWED_IPS = env.str("METRICS_ALLOWED_IPS", "127.0.0.1").split(",")
+# Proxy addresses whose X-Real-IP header names the client (nginx)
+METRICS_TRUSTED_PROXIES = env.str("METRICS_TRUSTED_PROXIES", "").split(",")
+# Bearer token that grants access to /metrics/ from any address when set
+METRICS_TOKEN = env.str("METRICS_TOKEN", "")
+
+# WILDBERRIES CLIENT CONFIGURATION
+# Base URL of a local stand-in (``manage.py run_fake_wildberries``) to send
+# all Wildberries requests to instead of the live site
+WB_UPSTREAM_URL = env.str("WB_UPSTREAM_URL", "")
+# Prefix of the raw Redis keys shared by the client's rate limiter and baskets
+WB_REDIS_KEY_PREFIX = env.str("WB_REDIS_KEY_PREFIX", "wb")
+WB_FETCH_CONCURRENCY = env.int("WB_FETCH_CONCURRENCY", 16)
+WB_FETCH_PER_HOST_CONCURRENCY = env.int("WB_FETCH_PER_HOST_CONCURRENCY", 4)
+WB_FETCH_BATCH_SIZE = env.int("WB_FETCH_BATCH_SIZE", 100)
+WB_REQUEST_TIMEOUT = env.float("WB_REQUEST_TIMEOUT", 10.0)
+WB_POOL_CONNECTIONS = env.int("WB_POOL_CONNECTIONS", 10)
+WB_POOL_MAXSIZE = env.int("WB_POOL_MAXSIZE", 16)
+WB_SESSION_MAX_REQUESTS = env.int("WB_SESSION_MAX_REQUESTS", 1000)
+WB_FEEDBACK_BASKETS = env.int("WB_FEEDBACK_BASKETS", 10)
+WB_BASKET_MAPPING_REFRESH_SECONDS = env.int("WB_BASKET_MAPPING_REFRESH_SECONDS", 300)
+WB_MEDIA_PROBE_HIT_TTL = env.int("WB_MEDIA_PROBE_HIT_TTL", 7 * 24 * 60 * 60)
+WB_MEDIA_PROBE_MISS_TTL = env.int("WB_MEDIA_PROBE_MISS_TTL", 60 * 60)
+WB_CATALOG_MAX_PAGES = env.int("WB_CATALOG_MAX_PAGES", 5)
+WB_CATALOG_MAX_PRODUCTS = env.int("WB_CATALOG_MAX_PRODUCTS", 500)
+WB_CATALOG_MAX_SECONDS = env.float("WB_CATALOG_MAX_SECONDS", 30.0)
+WB_CATEGORY_MENU_REFRESH_SECONDS = env.int("WB_CATEGORY_MENU_REFRESH_SECONDS", 3600)
+WB_CATEGORY_CACHE_SECONDS = env.int("WB_CATEGORY_CACHE_SECONDS", 86400)
+WB_PRODUCT_PAGE_CHUNK_SIZE = env.int("WB_PRODUCT_PAGE_CHUNK_SIZE", 16384)
+WB_IMAGE_BACKFILL_BATCH_SIZE = env.int("WB_IMAGE_BACKFILL_BATCH_SIZE", 10000)
+
+# Requests per second allowed per host, matched by host name suffix
+WB_RATE_LIMITS = env.dict(
+    "WB_RATE_LIMITS",
+    {
+        "catalog.wb.ru": 10.0,
+        "card.wb.ru": 5.0,
+        "feedbacks2.wb.ru": 10.0,
+        "wbbasket.ru": 20.0,
+        "wildberries.ru": 2.0,
+        "static-basket-01.wb.ru": 2.0,
+    },
+    subcast_values=float,
+)
+WB_RATE_LIMIT_DEFAULT = env.float("WB_RATE_LIMIT_DEFAULT", 5.0)
+WB_RATE_LIMIT_BURST_SECONDS = env.float("WB_RATE_LIMIT_BURST_SECONDS", 1.0)
+WB_RATE_LIMIT_MAX_WAIT = env.float("WB_RATE_LIMIT_MAX_WAIT", 60.0)
+WB_RATE_LIMIT_MIN_FACTOR = env.float("WB_RATE_LIMIT_MIN_FACTOR", 0.1)
+WB_RATE_LIMIT_RECOVERY_STEP = env.float("WB_RATE_LIMIT_RECOVERY_STEP", 0.02)
+
+WB_RETRY_MAX_ATTEMPTS = env.int("WB_RETRY_MAX_ATTEMPTS", 2)
+WB_RETRY_BACKOFF_BASE = env.float("WB_RETRY_BACKOFF_BASE", 0.5)
+WB_RETRY_BACKOFF_MAX = env.float("WB_RETRY_BACKOFF_MAX", 10.0)
+WB_RETRY_BUDGET_RATIO = env.float("WB_RETRY_BUDGET_RATIO", 0.2)
+WB_RETRY_BUDGET_MAX_TOKENS = env.float("WB_RETRY_BUDGET_MAX_TOKENS", 20.0)
+WB_BREAKER_FAILURE_THRESHOLD = env.int("WB_BREAKER_FAILURE_THRESHOLD", 5)
+WB_BREAKER_RESET_SECONDS = env.float("WB_BREAKER_RESET_SECONDS", 60.0)
 
 CSRF_TRUSTED_ORIGINS = env.str("CSRF_TRUSTED_ORIGINS", "").split(",")
 
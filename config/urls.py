@@ -15,6 +15,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from core.views import metrics_view
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
@@ -62,6 +63,7 @@ urlpatterns = [
         name="schema-swagger-ui",
     ),
     path("silk/", include("silk.urls", namespace="silk")),
+    path("metrics/", metrics_view, name="metrics"),
 ]
 
 if settings.DEBUG: